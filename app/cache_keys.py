@@ -0,0 +1,124 @@
+"""
+Cache key builder shared by the services and tools.synchronization.
+
+Every cached response lives under a key that embeds the version of the scope
+it belongs to. A version is built from generation counters:
+
+- catalog: bumped when the whole catalog is cleared
+- menus: the menus list
+- menu: everything below one menu (the menu itself, its submenus, their dishes)
+- submenu: everything below one submenu (its dishes)
+- tree: the full nested tree served by GET /api/v1/menu; bumped together with
+  any other counter by cache_manager.invalidate_many, since any change shows up there
+
+Invalidating a scope is a single INCR of its counter: every page and object
+cached under the old version becomes unreachable and expires through its TTL.
+The counters of deleted menus and submenus are retired: bumped one last time,
+then left to expire (see cache_manager.invalidate_many).
+
+A page read through cache_manager.get_or_revalidate also has a slot: its key
+under the version LATEST, holding the key of the last version stored, which is
+served while the page is computed again after an invalidation.
+
+Every version also starts with the epoch, a random token set once when Redis
+does not have it. Counters restart from zero after Redis loses its data, and the
+new epoch keeps the versions (and the ETags derived from them) from repeating.
+"""
+
+NAMESPACE = 'menuapp'
+LATEST = 'latest'
+
+
+# ----------------------------- generation counters
+
+
+def epoch() -> str:
+    return f'{NAMESPACE}:epoch'
+
+
+def catalog_generation() -> str:
+    return f'{NAMESPACE}:gen:catalog'
+
+
+def menus_generation() -> str:
+    return f'{NAMESPACE}:gen:menus'
+
+
+def menu_generation(menu_id: str) -> str:
+    return f'{NAMESPACE}:gen:menu:{menu_id}'
+
+
+def submenu_generation(menu_id: str, submenu_id: str) -> str:
+    return f'{NAMESPACE}:gen:menu:{menu_id}:submenu:{submenu_id}'
+
+
+def tree_generation() -> str:
+    return f'{NAMESPACE}:gen:tree'
+
+
+# ----------------------------- scopes (generation counters a key depends on)
+
+
+def menus_scope() -> list[str]:
+    return [menus_generation()]
+
+
+def menu_scope(menu_id: str) -> list[str]:
+    return [catalog_generation(), menu_generation(menu_id)]
+
+
+def submenu_scope(menu_id: str, submenu_id: str) -> list[str]:
+    return [*menu_scope(menu_id), submenu_generation(menu_id, submenu_id)]
+
+
+def tree_scope() -> list[str]:
+    return [tree_generation()]
+
+
+# ----------------------------- PAGES
+
+
+def _page(skip: int, limit: int, after: str | None) -> str:
+    # skip/limit pages and keyset pages (after an id, see app.pagination) never share a key
+    return f'{skip}:{limit}' if after is None else f'after:{after}:{limit}'
+
+# ----------------------------- MENU TREE
+
+
+def tree(version: str, skip: int, limit: int, after: str | None = None) -> str:
+    return f'{NAMESPACE}:tree:v{version}:{_page(skip, limit, after)}'
+
+
+# ----------------------------- MENU
+
+
+def menus_list(version: str, skip: int, limit: int, after: str | None = None) -> str:
+    return f'{NAMESPACE}:menus:v{version}:{_page(skip, limit, after)}'
+
+
+def menu(menu_id: str, version: str) -> str:
+    return f'{NAMESPACE}:menu:{menu_id}:v{version}'
+
+# ------------------------------ SUBMENUS
+
+
+def submenus_list(menu_id: str, version: str, skip: int, limit: int, after: str | None = None) -> str:
+    return f'{NAMESPACE}:menu:{menu_id}:v{version}:submenus:{_page(skip, limit, after)}'
+
+
+def submenu(menu_id: str, submenu_id: str, version: str) -> str:
+    return f'{NAMESPACE}:menu:{menu_id}:submenu:{submenu_id}:v{version}'
+
+# ----------------------------- DISHES
+
+
+def dishes_list(menu_id: str, submenu_id: str, version: str, skip: int, limit: int, after: str | None = None) -> str:
+    return f'{NAMESPACE}:menu:{menu_id}:submenu:{submenu_id}:v{version}:dishes:{_page(skip, limit, after)}'
+
+
+def dish(menu_id: str, submenu_id: str, dish_id: str, version: str) -> str:
+    return f'{NAMESPACE}:menu:{menu_id}:submenu:{submenu_id}:dish:{dish_id}:v{version}'
+
+
+def lock(key: str) -> str:
+    return f'{key}:lock'
@@ -1,8 +1,36 @@
+import asyncio
+import logging
+import secrets
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
 from typing import Any
 
 from redis import asyncio as aioredis  # type: ignore[import]
+from redis.exceptions import LockError  # type: ignore[import]
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from config import REDIS_DB, REDIS_HOST, REDIS_PASSWORD, REDIS_PORT
+from app import cache_keys
+from config import (
+    CACHE_DISTRIBUTED_LOCK,
+    CACHE_INVALIDATION_CHANNEL,
+    CACHE_LOCK_LEASE,
+    CACHE_LOCK_POLL_INTERVAL,
+    CACHE_RETIRED_GENERATION_TTL,
+    CACHE_TTLS,
+    L1_CACHE_MAX_ENTRIES,
+    L1_CACHE_TTL,
+    L1_GENERATION_TTL,
+    REDIS_DB,
+    REDIS_HEALTH_CHECK_INTERVAL,
+    REDIS_HOST,
+    REDIS_MAX_CONNECTIONS,
+    REDIS_PASSWORD,
+    REDIS_POOL_TIMEOUT,
+    REDIS_PORT,
+    REDIS_SOCKET_CONNECT_TIMEOUT,
+    REDIS_SOCKET_TIMEOUT,
+)
 
 REDIS_URL = f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}'
 
@@ -10,24 +38,446 @@ if REDIS_PASSWORD:
     REDIS_URL = f'redis://:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}'
 
 
+class LocalCache:
+    """
+    Bounded in-process LRU cache with a per-entry TTL, kept in front of Redis.
+    """
+
+    def __init__(self, max_entries: int = L1_CACHE_MAX_ENTRIES, ttl: float = L1_CACHE_TTL) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, keys) -> None:
+        for key in keys:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+local_cache = LocalCache()
+
+_redis: Any = None
+_listener: asyncio.Task | None = None
+# Generation counters are only served from local_cache while the invalidation listener is connected;
+# otherwise a missed bump could not be noticed before L1_GENERATION_TTL.
+_listener_connected = False
+# Cache misses currently being computed in this process, see get_or_compute()
+_in_flight: dict[str, asyncio.Future] = {}
+# Background work per key: storing a soft-expired entry again, or computing the version of a page
+# whose previous one is being served meanwhile (see get_or_revalidate)
+_refreshing: dict[str, asyncio.Task] = {}
+
+
+async def init_redis(url: str = REDIS_URL) -> Any:
+    """
+    Create the process-wide Redis client backed by a bounded, blocking connection pool.
+
+    Called from the FastAPI startup hook; other processes (e.g. Celery) get it lazily
+    through get_redis_connection().
+    """
+    global _redis
+
+    if _redis is None:
+        pool: aioredis.BlockingConnectionPool = aioredis.BlockingConnectionPool.from_url(
+            url,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        )
+        _redis = aioredis.Redis(connection_pool=pool)
+    return _redis
+
+
+async def close_redis() -> None:
+    global _redis
+
+    await stop_invalidation_listener()
+    if _redis is not None:
+        client, _redis = _redis, None
+        await client.close()
+        await client.connection_pool.disconnect()
+
+
 async def get_redis_connection() -> Any:
-    return await aioredis.from_url(REDIS_URL)
+    if _redis is None:
+        return await init_redis()
+    return _redis
 
 
 async def get_from_cache(key) -> bytes | None:
+    value = local_cache.get(key)
+    if value is not None:
+        return value
     connection = await get_redis_connection()
     value = await connection.get(key)
-    await connection.close()
+    if value is not None:
+        local_cache.set(key, value)
     return value
 
 
 async def set_in_cache(key, value, expiration_time=3600) -> None:
     connection = await get_redis_connection()
     await connection.setex(key, expiration_time, value)
-    await connection.close()
+    local_cache.set(key, value.encode('utf-8') if isinstance(value, str) else value,
+                    ttl=min(L1_CACHE_TTL, expiration_time))
 
 
 async def invalidate_cache(key) -> None:
+    await invalidate_many([key])
+
+
+def _pack(value: bytes, soft_ttl: float) -> bytes:
+    # The soft expiry travels with the value, so a hit knows whether it is due without asking Redis
+    return b'%.3f\n' % (time.time() + soft_ttl) + value
+
+
+def _unpack(entry: bytes) -> tuple[float, bytes] | None:
+    header, _, value = entry.partition(b'\n')
+    try:
+        return float(header), value
+    except ValueError:
+        return None  # not written by get_or_compute
+
+
+def _lock(connection: Any, key: str) -> Any:
+    return connection.lock(cache_keys.lock(key), timeout=CACHE_LOCK_LEASE, blocking=False, thread_local=False)
+
+
+def _ttls(family: str) -> tuple[int, int]:
+    return CACHE_TTLS.get(family, CACHE_TTLS['default'])
+
+
+async def get_or_compute(key, compute: Callable[[Any], Awaitable[bytes]], db, family='default') -> bytes:
+    """
+    Return the cached value of key, computing it with compute(db) and caching it on a miss.
+
+    Entries get the (soft, hard) TTLs of their family (CACHE_TTLS): Redis drops them
+    after the hard one, and a hit past the soft one is served as is while a background
+    task stores it again with fresh TTLs. Keys are versioned (see app.cache_keys), so
+    what a key holds never changes and that task never needs the database.
+
+    Concurrent misses for the same key, including every reader of a scope that
+    was just invalidated, are coalesced: within the process they await the one
+    in-flight computation, and with CACHE_DISTRIBUTED_LOCK other workers wait
+    for the lock holder to fill the cache instead of querying the database themselves.
+    """
+    ttls = _ttls(family)
+    value = await _cached(key, ttls)
+    if value is not None:
+        return value
+    return await _compute_coalesced(key, compute, db, ttls)
+
+
+async def get_or_revalidate(key, slot, scope, compute: Callable[[Any], Awaitable[bytes]], db,
+                            family='default') -> tuple[str, bytes]:
+    """
+    get_or_compute() that serves the previous version of a page rather than wait for
+    the current one. Returns the key of the body it serves along with the body, so the
+    caller can send it under its own ETag.
+
+    slot is the page's key under the version cache_keys.LATEST, which points to the
+    last version stored, and scope the generation counters of key's version. When
+    the scope was invalidated since, the version slot points to is served for as long
+    as Redis still has it (its hard TTL), while one background task per key computes
+    the current one with a session of its own. A retired scope has no previous
+    version: its menu or submenu is gone, and the caller must get the 404.
+    """
+    ttls = _ttls(family)
+    value = await _cached(key, ttls, slot)
+    if value is not None:
+        return key, value
+    stale = await _stale(slot, scope)
+    if stale is None:
+        return key, await _compute_coalesced(key, compute, db, ttls, slot)
+    logging.debug(f'Serving {stale[0]} while {key} is computed')
+    if key not in _refreshing:
+        _run_in_background(key, _refresh(key, compute, db, ttls, slot))
+    return stale
+
+
+async def _cached(key, ttls: tuple[int, int], slot=None) -> bytes | None:
+    entry = await get_from_cache(key)
+    cached = _unpack(entry) if entry is not None else None
+    if cached is None:
+        return None
+    logging.debug(f'Cache hit for key {key}')
+    soft_expiry, value = cached
+    if soft_expiry < time.time() and key not in _refreshing:
+        _run_in_background(key, _extend(key, value, ttls, slot))
+    return value
+
+
+async def _stale(slot, scope) -> tuple[str, bytes] | None:
     connection = await get_redis_connection()
-    await connection.delete(key)
-    await connection.close()
+    async with connection.pipeline(transaction=False) as pipe:
+        pipe.get(slot)
+        for generation in scope:
+            pipe.ttl(generation)
+        previous, *expiries = await pipe.execute()
+    # Only retired counters have an expiry, see invalidate_many
+    if previous is None or any(expiry >= 0 for expiry in expiries):
+        return None
+    previous = previous.decode('utf-8')
+    entry = await get_from_cache(previous)
+    cached = _unpack(entry) if entry is not None else None
+    return (previous, cached[1]) if cached is not None else None
+
+
+async def _compute_coalesced(key, compute: Callable[[Any], Awaitable[bytes]], db, ttls: tuple[int, int],
+                             slot=None) -> bytes:
+    while (flight := _in_flight.get(key)) is not None:
+        try:
+            return await asyncio.shield(flight)
+        except asyncio.CancelledError:
+            if not flight.cancelled():
+                raise
+            # The request computing the value went away; take over
+
+    logging.debug(f'Cache miss for key {key}')
+    flight = asyncio.get_running_loop().create_future()
+    _in_flight[key] = flight
+    try:
+        value = await _compute_once(key, compute, db, ttls, slot)
+    except asyncio.CancelledError:
+        flight.cancel()
+        raise
+    except BaseException as exc:
+        flight.set_exception(exc)
+        flight.exception()  # waiters re-raise it; don't log it as never retrieved
+        raise
+    else:
+        flight.set_result(value)
+        return value
+    finally:
+        del _in_flight[key]
+
+
+async def _compute_once(key, compute: Callable[[Any], Awaitable[bytes]], db, ttls: tuple[int, int],
+                        slot=None) -> bytes:
+    if not CACHE_DISTRIBUTED_LOCK:
+        value = await compute(db)
+        await _store(key, value, ttls, slot)
+        return value
+
+    connection = await get_redis_connection()
+    lock = _lock(connection, key)
+    deadline = time.monotonic() + CACHE_LOCK_LEASE
+    acquired = await lock.acquire()
+    while not acquired and time.monotonic() < deadline:
+        await asyncio.sleep(CACHE_LOCK_POLL_INTERVAL)
+        entry = await connection.get(key)
+        cached = _unpack(entry) if entry is not None else None
+        if cached is not None:
+            local_cache.set(key, entry)
+            return cached[1]
+        acquired = await lock.acquire()
+
+    try:
+        value = await compute(db)
+        await _store(key, value, ttls, slot)
+        return value
+    finally:
+        if acquired:
+            try:
+                await lock.release()
+            except LockError:
+                pass  # the lease expired while computing
+
+
+async def _store(key, value: bytes, ttls: tuple[int, int], slot=None) -> None:
+    soft_ttl, hard_ttl = ttls
+    entry = _pack(value, soft_ttl)
+    if slot is None:
+        await set_in_cache(key, entry, hard_ttl)
+        return
+    connection = await get_redis_connection()
+    async with connection.pipeline(transaction=False) as pipe:
+        pipe.set(key, entry, ex=hard_ttl)
+        pipe.set(slot, key, ex=hard_ttl)
+        await pipe.execute()
+    local_cache.set(key, entry, ttl=min(L1_CACHE_TTL, hard_ttl))
+
+
+def _run_in_background(key, work: Awaitable[None]) -> None:
+    async def run() -> None:
+        try:
+            await work
+        except Exception:
+            logging.exception(f'Refreshing the cache entry {key} failed')
+
+    _refreshing[key] = asyncio.create_task(run())
+    _refreshing[key].add_done_callback(lambda _: _refreshing.pop(key, None))
+
+
+async def _extend(key, value: bytes, ttls: tuple[int, int], slot=None) -> None:
+    soft_ttl, hard_ttl = ttls
+    entry = _pack(value, soft_ttl)
+    connection = await get_redis_connection()
+    # XX: an entry deleted in the meantime stays deleted
+    if await connection.set(key, entry, ex=hard_ttl, xx=True):
+        local_cache.set(key, entry, ttl=min(L1_CACHE_TTL, hard_ttl))
+        if slot is not None:
+            await connection.set(slot, key, ex=hard_ttl)
+
+
+async def _refresh(key, compute: Callable[[Any], Awaitable[bytes]], db: AsyncSession, ttls: tuple[int, int],
+                   slot) -> None:
+    # The request's session goes back to the pool with the response, so the refresh opens its own
+    async with AsyncSession(db.bind) as session:
+        await _compute_coalesced(key, compute, session, ttls, slot)
+
+
+async def _seed_epoch(connection: Any) -> bytes:
+    # SET NX: when several processes find the epoch missing, the first token wins and all read it back
+    await connection.set(cache_keys.epoch(), secrets.token_hex(4), nx=True)
+    return await connection.get(cache_keys.epoch())
+
+
+async def get_version(generations) -> str:
+    """
+    Read the epoch and the generation counters of a scope (see app.cache_keys) and
+    join them into the version string embedded in cache keys and ETags. Values known
+    to local_cache are served from memory, the rest come from one MGET.
+    """
+    generations = [cache_keys.epoch(), *generations]
+    values: list[Any] = [local_cache.get(generation) if _listener_connected else None for generation in generations]
+    missing = [generation for generation, value in zip(generations, values) if value is None]
+    if missing:
+        connection = await get_redis_connection()
+        fetched = dict(zip(missing, await connection.mget(missing)))
+        if cache_keys.epoch() in fetched and fetched[cache_keys.epoch()] is None:
+            fetched[cache_keys.epoch()] = await _seed_epoch(connection)
+        for index, generation in enumerate(generations):
+            if values[index] is None:
+                value = fetched[generation]
+                values[index] = value.decode('utf-8') if value else '0'
+                if _listener_connected:
+                    local_cache.set(generation, values[index], ttl=L1_GENERATION_TTL)
+    return '.'.join(values)
+
+
+async def invalidate_many(keys=(), generations=(), retired=(), chunk_size=1000) -> None:
+    """
+    Delete every key and bump every generation counter in one round trip.
+    Bumping any generation also bumps the menu tree's, which contains everything.
+
+    retired are the counters of deleted menus and submenus: they are bumped too, then
+    expire after CACHE_RETIRED_GENERATION_TTL instead of staying in Redis for good.
+    They are not deleted right away, since a counter back at 0 would make the entries
+    cached before its first bump reachable again. Counters bumped as live ones drop
+    such an expiry, in case a synchronized row comes back under the same id.
+
+    The same pipeline publishes the affected names on CACHE_INVALIDATION_CHANNEL
+    so every worker drops them from its local_cache.
+    """
+    keys = list(dict.fromkeys(keys))
+    retired = list(dict.fromkeys(retired))
+    generations = [generation for generation in dict.fromkeys(generations) if generation not in retired]
+    if (generations or retired) and cache_keys.tree_generation() not in generations:
+        generations.append(cache_keys.tree_generation())
+    if not keys and not generations:
+        return
+    local_cache.invalidate([*keys, *generations, *retired])
+    connection = await get_redis_connection()
+    async with connection.pipeline(transaction=False) as pipe:
+        for start in range(0, len(keys), chunk_size):
+            pipe.delete(*keys[start:start + chunk_size])
+        for generation in generations:
+            pipe.incr(generation)
+            pipe.persist(generation)
+        for generation in retired:
+            pipe.incr(generation)
+            pipe.expire(generation, CACHE_RETIRED_GENERATION_TTL)
+        pipe.publish(CACHE_INVALIDATION_CHANNEL, '\n'.join([*keys, *generations, *retired]))
+        await pipe.execute()
+
+
+async def _listen_for_invalidations() -> None:
+    global _listener_connected
+
+    delay = 0.5
+    while True:
+        connection = await get_redis_connection()
+        pubsub = connection.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+            # Anything published while we were disconnected is lost, so start from a clean slate
+            local_cache.clear()
+            _listener_connected = True
+            delay = 0.5
+            while True:
+                # An explicit read timeout replaces the pool's socket timeout, which would otherwise
+                # fail the read whenever no write happens for a while; None just means no message yet.
+                # Every call also PINGs a connection idle for REDIS_HEALTH_CHECK_INTERVAL.
+                message = await pubsub.get_message(timeout=REDIS_HEALTH_CHECK_INTERVAL)
+                if message is not None and message['type'] == 'message':
+                    local_cache.invalidate(message['data'].decode('utf-8').split('\n'))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception('Cache invalidation listener disconnected')
+        finally:
+            _listener_connected = False
+            await pubsub.close()
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 30)
+
+
+def start_invalidation_listener() -> None:
+    global _listener
+
+    if _listener is None:
+        _listener = asyncio.create_task(_listen_for_invalidations())
+
+
+async def stop_invalidation_listener() -> None:
+    global _listener, _listener_connected
+
+    if _listener is not None:
+        listener, _listener = _listener, None
+        listener.cancel()
+        try:
+            await listener
+        except asyncio.CancelledError:
+            pass
+    _listener_connected = False
@@ -1,11 +1,16 @@
+from config import SYNC_MIN_INTERVAL
+
 broker_url = 'pyamqp://guest@rabbitmq//'
 result_backend = 'redis://redis:6379/0'
 
 imports = ('app.celery_worker',)
 
 beat_schedule = {
-    'add-menu-every-20-seconds': {
+    # Ticks at the shortest check interval; add_menu skips those not due under the adaptive interval
+    'add-menu': {
         'task': 'app.celery_worker.add_menu',
-        'schedule': 15.0
+        'schedule': float(SYNC_MIN_INTERVAL),
+        # A tick still queued when the next one is due is dropped instead of piling up behind a slow sync
+        'options': {'expires': float(SYNC_MIN_INTERVAL)},
     },
 }
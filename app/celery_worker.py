@@ -1,12 +1,15 @@
-import asyncio
 import logging
-import time
 
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
 
-from app.cache_manager import invalidate_cache
-from app.main import get_db
+from app.cache_manager import invalidate_many
+from app.worker_runtime import runtime
+from config import WORKER_READY_TIMEOUT
+from tools.file_watcher import file_signature, has_file_changed
+from tools.hash_store import load_hash, save_hash
 from tools.parse_excel import parse_menu_excel
+from tools.sync_scheduler import run_coalesced
 from tools.synchronization import synchronize_menus
 
 logging.basicConfig(level=logging.DEBUG)
@@ -16,39 +19,64 @@ celery_app = Celery('myapp', broker='pyamqp://guest@rabbitmq//', backend='redis:
 celery_app.config_from_object('app.celery_config')
 
 
-has_run_once = False
+MENU_FILE_PATH = 'admin/Menu.xlsx'
 
 
-@celery_app.task(bind=True)
-def add_menu(self) -> None:
+@worker_process_init.connect
+def start_runtime(**kwargs) -> None:
+    # Once per worker process: the loop, engine and Redis pool then live as long as the process.
+    # The readiness probe runs in the background: the prefork pool kills a child that does not
+    # report up within a few seconds, and add_menu checks readiness itself before each sync.
+    runtime.start()
+    runtime.submit(runtime.wait_until_ready(WORKER_READY_TIMEOUT))
 
-    global has_run_once
 
-    if not has_run_once:
-        time.sleep(30)
-        has_run_once = True
+@worker_process_shutdown.connect
+def stop_runtime(**kwargs) -> None:
+    runtime.stop()
 
-    json_menu = parse_menu_excel('admin/Menu.xlsx')
-    logging.info('Starting add_menu task.')
 
-    async def async_add_menu():
+async def synchronize_menu_file(file_path: str) -> bool:
+    """Synchronize the database with file_path if it changed; returns whether it did."""
+    previous_hash, previous_signature = await load_hash(file_path)
+    signature = file_signature(file_path)
+    if signature == previous_signature:
+        logging.info(f'{file_path} untouched since the last sync, skipping.')
+        return False
 
-        logging.info('async_add_menu')
+    changed, current_hash = await runtime.run_blocking(has_file_changed, file_path, previous_hash)
+    if not changed:
+        # Touched but identical content: remember the new signature so the next tick skips hashing
+        await save_hash(current_hash, signature, file_path)
+        logging.info(f'{file_path} content unchanged, skipping.')
+        return False
 
-        async for session in get_db():
+    json_menu = await runtime.run_blocking(parse_menu_excel, file_path)
 
-            invalidated_keys = await synchronize_menus(session, json_menu)
-            for key in invalidated_keys:
-                await invalidate_cache(key)
+    async with runtime.session() as session:
+        changeset = await synchronize_menus(session, json_menu)
 
-            # Invalidate the list cache key as well
-            await invalidate_cache('menus-0-100')
+    # Bump only the scopes covering changed rows, in one round trip
+    if changeset:
+        await invalidate_many(generations=changeset.generations, retired=changeset.retired)
 
-    loop = asyncio.get_event_loop()
+    # Only recorded once the sync went through, so a failed run is retried on the next tick
+    await save_hash(current_hash, signature, file_path)
+    return True
 
-    if loop.is_closed():
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
 
-    loop.run_until_complete(async_add_menu())
-    logging.info('Task complete.')
+@celery_app.task(bind=True)
+def add_menu(self, triggered: bool = False) -> None:
+    """
+    Beat tick (or, with triggered, a file-system notification) syncing MENU_FILE_PATH,
+    scheduled and serialized across workers by tools.sync_scheduler.run_coalesced.
+    """
+
+    # Started lazily as well, for pools that do not send worker_process_init (solo, threads)
+    runtime.start()
+    if not runtime.ready and not runtime.run(runtime.probe()):
+        logging.warning('Postgres or Redis not ready, skipping add_menu until the next tick.')
+        return
+
+    ran = runtime.run(run_coalesced(MENU_FILE_PATH, lambda: synchronize_menu_file(MENU_FILE_PATH), triggered))
+    logging.info(f'add_menu task complete ({"synchronized" if ran else "skipped"}).')
@@ -1,19 +1,25 @@
 import logging
 
-from fastapi import Depends, FastAPI
+from fastapi import Depends, FastAPI, Header, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from app.model.base import Base
+from app.cache_manager import (
+    close_redis,
+    init_redis,
+    local_cache,
+    start_invalidation_listener,
+)
+from app.responses import ORJSONResponse, wants_ndjson
 from app.schema.schemas import CompleteMenu, DishCreate, DishModel
 from app.schema.schemas import Menu as MenuModel
-from app.schema.schemas import MenuCreate
+from app.schema.schemas import MenuCreate, Page
 from app.schema.schemas import SubMenu as SubMenuModel
 from app.schema.schemas import SubMenuCreate
 from app.services.dish import DishService as dish_service
 from app.services.menu import MenuService as menu_service
 from app.services.submenu import SubMenuService as submenu_service
-from db.database import SessionLocal, engine
+from db.database import SessionLocal, engine, pool_stats
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -22,13 +28,23 @@ async def get_db() -> AsyncSession:
     async with SessionLocal() as session:
         yield session
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 
 @app.on_event('startup')
 async def startup_event() -> None:
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    await init_redis()
+    start_invalidation_listener()
+
+
+@app.on_event('shutdown')
+async def shutdown_event() -> None:
+    await close_redis()
+
+
+@app.get('/metrics', include_in_schema=False)
+async def metrics() -> dict:
+    return {'l1_cache': local_cache.stats(), 'db_pool': pool_stats(engine)}
 
 # reverse function
 
@@ -52,33 +68,63 @@ async def create_menu(menu: MenuCreate, db: AsyncSession = Depends(get_db)) -> M
     return await menu_service.create_menu(db, menu)
 
 
-@app.get('/api/v1/menu')
-async def read_all_menus(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)) -> list[CompleteMenu]:
+@app.get('/api/v1/menu', response_model=list[CompleteMenu] | Page[CompleteMenu])
+async def read_all_menus(skip: int = 0, limit: int = 100, cursor: str | None = None, stream: bool = False,
+                         accept: str | None = Header(default=None),
+                         if_none_match: str | None = Header(default=None), db: Session = Depends(get_db)) -> Response:
+    """
+    Retrieve menus with their submenus and dishes
 
-    return await menu_service.read_all_menus(db, skip, limit)
+    - **skip**, **limit**, **cursor**: As for /api/v1/menus
+    - **stream**: Stream the whole catalog as it is read from the database; skip, limit and
+      cursor are ignored (optional, default false)
+    - **Accept**: application/x-ndjson streams the whole catalog as well, one menu per line
+      (optional header)
+    - **If-None-Match**: ETag of an earlier response; answered with 304 Not Modified while
+      the data is unchanged (optional header)
+    """
 
+    if stream or wants_ndjson(accept):
+        return await menu_service.stream_all_menus(db, wants_ndjson(accept), if_none_match)
 
-@app.get('/api/v1/menus', response_model=list[MenuModel])
-async def read_menus(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)) -> list[MenuModel]:
+    return await menu_service.read_all_menus(db, skip, limit, cursor, if_none_match)
+
+
+@app.get('/api/v1/menus', response_model=list[MenuModel] | Page[MenuModel])
+async def read_menus(skip: int = 0, limit: int = 100, cursor: str | None = None,
+                     accept: str | None = Header(default=None),
+                     if_none_match: str | None = Header(default=None), db: Session = Depends(get_db)) -> Response:
     """
     Retrieve a list of menus
 
     - **skip**: Number of records to skip (optional, default 0)
     - **limit**: Number of records to return (optional, default 100)
+    - **cursor**: Keyset pagination, empty for the first page; the response becomes
+      {items, next_cursor} and skip is ignored (optional)
+    - **Accept**: application/x-ndjson streams every menu instead, one JSON object per line;
+      skip, limit and cursor are ignored (optional header)
+    - **If-None-Match**: ETag of an earlier response; answered with 304 Not Modified while
+      the data is unchanged (optional header)
     """
 
-    return await menu_service.read_menus(db, skip, limit)
+    if wants_ndjson(accept):
+        return await menu_service.stream_menus(db, if_none_match)
+
+    return await menu_service.read_menus(db, skip, limit, cursor, if_none_match)
 
 
 @app.get('/api/v1/menus/{menu_id}', response_model=MenuModel)
-async def read_menu(menu_id: str, db: Session = Depends(get_db)) -> MenuModel:
+async def read_menu(menu_id: str, if_none_match: str | None = Header(default=None),
+                    db: Session = Depends(get_db)) -> Response:
     """
     Retrieve a specific menu by ID
 
     - **menu_id**: The ID of the menu to retrieve
+    - **If-None-Match**: ETag of an earlier response; answered with 304 Not Modified while
+      the data is unchanged (optional header)
     """
 
-    return await menu_service.read_menu(db, menu_id)
+    return await menu_service.read_menu(db, menu_id, if_none_match)
 
 
 @app.patch('/api/v1/menus/{menu_id}', response_model=MenuModel)
@@ -128,29 +174,43 @@ async def create_submenu(menu_id: str, submenu: SubMenuCreate, db: Session = Dep
     return await submenu_service.create_submenu(db, menu_id, submenu)
 
 
-@app.get('/api/v1/menus/{menu_id}/submenus', response_model=list[SubMenuModel])
-async def read_submenus(menu_id: str, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)) -> list[SubMenuModel]:
+@app.get('/api/v1/menus/{menu_id}/submenus', response_model=list[SubMenuModel] | Page[SubMenuModel])
+async def read_submenus(menu_id: str, skip: int = 0, limit: int = 100, cursor: str | None = None,
+                        accept: str | None = Header(default=None),
+                        if_none_match: str | None = Header(default=None), db: Session = Depends(get_db)) -> Response:
     """
     Retrieve a list of submenus under a specific menu
 
     - **menu_id**: The ID of the parent menu
     - **skip**: Number of records to skip (optional, default 0)
     - **limit**: Number of records to return (optional, default 100)
+    - **cursor**: Keyset pagination, empty for the first page; the response becomes
+      {items, next_cursor} and skip is ignored (optional)
+    - **Accept**: application/x-ndjson streams every submenu of the menu instead, one JSON object per line;
+      skip, limit and cursor are ignored (optional header)
+    - **If-None-Match**: ETag of an earlier response; answered with 304 Not Modified while
+      the data is unchanged (optional header)
     """
 
-    return await submenu_service.read_submenus(db, menu_id, skip, limit)
+    if wants_ndjson(accept):
+        return await submenu_service.stream_submenus(db, menu_id, if_none_match)
+
+    return await submenu_service.read_submenus(db, menu_id, skip, limit, cursor, if_none_match)
 
 
 @app.get('/api/v1/menus/{menu_id}/submenus/{submenu_id}', response_model=SubMenuModel)
-async def read_submenu(menu_id: str, submenu_id: str, db: Session = Depends(get_db)) -> SubMenuModel:
+async def read_submenu(menu_id: str, submenu_id: str, if_none_match: str | None = Header(default=None),
+                       db: Session = Depends(get_db)) -> Response:
     """
     Retrieve a specific submenu by ID
 
     - **menu_id**: The ID of the parent menu
     - **submenu_id**: The ID of the submenu to retrieve
+    - **If-None-Match**: ETag of an earlier response; answered with 304 Not Modified while
+      the data is unchanged (optional header)
     """
 
-    return await submenu_service.read_submenu(db, menu_id, submenu_id)
+    return await submenu_service.read_submenu(db, menu_id, submenu_id, if_none_match)
 
 
 @app.patch('/api/v1/menus/{menu_id}/submenus/{submenu_id}', response_model=SubMenuModel, status_code=200)
@@ -205,8 +265,10 @@ async def create_dish(menu_id: str, submenu_id: str, dish: DishCreate, db: Sessi
     return await dish_service.create_dish(db, menu_id, submenu_id, dish)
 
 
-@app.get('/api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes', response_model=list[DishModel])
-async def read_dishes(menu_id: str, submenu_id: str, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)) -> list[DishModel]:
+@app.get('/api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes', response_model=list[DishModel] | Page[DishModel])
+async def read_dishes(menu_id: str, submenu_id: str, skip: int = 0, limit: int = 100, cursor: str | None = None,
+                      accept: str | None = Header(default=None),
+                      if_none_match: str | None = Header(default=None), db: Session = Depends(get_db)) -> Response:
     """
     Retrieve a list of dishes under a specific submenu
 
@@ -214,22 +276,34 @@ async def read_dishes(menu_id: str, submenu_id: str, skip: int = 0, limit: int =
     - **submenu_id**: The ID of the parent submenu
     - **skip**: Number of records to skip (optional, default 0)
     - **limit**: Number of records to return (optional, default 100)
+    - **cursor**: Keyset pagination, empty for the first page; the response becomes
+      {items, next_cursor} and skip is ignored (optional)
+    - **Accept**: application/x-ndjson streams every dish of the submenu instead, one JSON object per line;
+      skip, limit and cursor are ignored (optional header)
+    - **If-None-Match**: ETag of an earlier response; answered with 304 Not Modified while
+      the data is unchanged (optional header)
     """
 
-    return await dish_service.read_dishes(db, menu_id, submenu_id, skip, limit)
+    if wants_ndjson(accept):
+        return await dish_service.stream_dishes(db, menu_id, submenu_id, if_none_match)
+
+    return await dish_service.read_dishes(db, menu_id, submenu_id, skip, limit, cursor, if_none_match)
 
 
 @app.get('/api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes/{dish_id}', response_model=DishModel)
-async def read_dish(menu_id: str, submenu_id: str, dish_id: str, db: Session = Depends(get_db)) -> DishModel:
+async def read_dish(menu_id: str, submenu_id: str, dish_id: str, if_none_match: str | None = Header(default=None),
+                    db: Session = Depends(get_db)) -> Response:
     """
     Retrieve a specific dish by ID
 
     - **menu_id**: The ID of the parent menu
     - **submenu_id**: The ID of the parent submenu
     - **dish_id**: The ID of the dish to retrieve
+    - **If-None-Match**: ETag of an earlier response; answered with 304 Not Modified while
+      the data is unchanged (optional header)
     """
 
-    return await dish_service.read_dish(db, menu_id, submenu_id, dish_id)
+    return await dish_service.read_dish(db, menu_id, submenu_id, dish_id, if_none_match)
 
 
 @app.patch('/api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes/{dish_id}', response_model=DishModel, status_code=200)
@@ -1,6 +1,6 @@
 import uuid
 
-from sqlalchemy import Column, ForeignKey, String
+from sqlalchemy import Column, ForeignKey, Index, Integer, String
 
 from app.model.base import Base
 
@@ -8,24 +8,30 @@ from app.model.base import Base
 class Menu(Base):
     __tablename__ = 'menus'
 
-    id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     title = Column(String)
     description = Column(String)
+    # Maintained by database triggers (migration 0003), never written by the application
+    submenus_count = Column(Integer, nullable=False, server_default='0')
+    dishes_count = Column(Integer, nullable=False, server_default='0')
 
 
 class SubMenu(Base):
     __tablename__ = 'submenus'
+    __table_args__ = (Index('ix_submenus_menu_id_id', 'menu_id', 'id'),)
 
-    id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     title = Column(String)
     menu_id = Column(String, ForeignKey('menus.id', ondelete='CASCADE'))
     description = Column(String)
+    dishes_count = Column(Integer, nullable=False, server_default='0')  # maintained by triggers, see Menu
 
 
 class Dish(Base):
     __tablename__ = 'dishes'
+    __table_args__ = (Index('ix_dishes_submenu_id_id', 'submenu_id', 'id'),)
 
-    id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     title = Column(String)
     price = Column(String)
     submenu_id = Column(String, ForeignKey('submenus.id', ondelete='CASCADE'))
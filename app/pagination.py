@@ -0,0 +1,65 @@
+"""
+Keyset (cursor) pagination for the list endpoints.
+
+A page is requested with ?cursor= (empty for the first page) and limit; it holds the
+rows ordered by id that come after the cursor, and the cursor of the next page, or
+None on the last one. The cursor is opaque to clients: the last id of the page,
+base64url-encoded. Without cursor the endpoints keep their skip/limit behaviour.
+"""
+import base64
+import binascii
+from typing import TypeVar
+
+from fastapi import HTTPException
+from sqlalchemy import ColumnElement, Select
+
+SelectT = TypeVar('SelectT', bound=Select)
+
+
+def encode_cursor(last_id: str) -> str:
+    return base64.urlsafe_b64encode(last_id.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str | None, limit: int) -> str | None:
+    """
+    Id after which the requested page starts: None without a cursor (skip/limit mode),
+    '' for the first page, which sorts before every id. A keyset page needs limit >= 1
+    to have a last row to continue from; skip/limit mode takes any limit, as it always has.
+    """
+    if cursor is None:
+        return None
+    if limit < 1:
+        raise HTTPException(status_code=422, detail='limit must be at least 1 with a cursor')
+    try:
+        return base64.b64decode(cursor + '=' * (-len(cursor) % 4), altchars=b'-_', validate=True).decode('utf-8')
+    except (binascii.Error, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail='invalid cursor')
+
+
+def paginate(stmt: SelectT, id_column: ColumnElement[str], skip: int, limit: int, after: str | None) -> SelectT:
+    """
+    stmt ordered by id_column and cut to one page: the rows after the cursor id in keyset
+    mode, where skip is ignored (pages are cached by cursor and limit only), otherwise
+    the rows after the first skip.
+    """
+    stmt = stmt.order_by(id_column).limit(limit)
+    if after is None:
+        return stmt.offset(skip)
+    return stmt.filter(id_column > after)
+
+
+def fetch_limit(limit: int, after: str | None) -> int:
+    # One extra row on keyset pages tells whether there is a next one
+    return limit if after is None else limit + 1
+
+
+def page_payload(items: list[dict], limit: int, after: str | None) -> list[dict] | dict:
+    """
+    The response body for items fetched with fetch_limit(): the list itself in skip/limit
+    mode, {'items': [...], 'next_cursor': ...} in keyset mode.
+    """
+    if after is None:
+        return items
+    if len(items) > limit:
+        return {'items': items[:limit], 'next_cursor': encode_cursor(items[limit - 1]['id'])}
+    return {'items': items, 'next_cursor': None}
@@ -1,26 +1,44 @@
+from collections.abc import AsyncIterator, Sequence
+from typing import cast
+
 from fastapi import HTTPException
-from sqlalchemy import delete, select
+from sqlalchemy import CursorResult, delete, insert, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.model.models import Dish, SubMenu
+from app.pagination import paginate
 from app.schema.schemas import DishCreate, DishModel
+from app.serialization import trusted
 
 
 class DishRepository:
 
     @staticmethod
     async def create_dish(db: AsyncSession, menu_id: str, submenu_id: str, dish: DishCreate) -> DishModel:
-        db_dish = Dish(title=dish.title, description=dish.description, price=dish.price, submenu_id=submenu_id)
-        db.add(db_dish)
+        result = await db.execute(
+            insert(Dish).values(title=dish.title, description=dish.description, price=dish.price, submenu_id=submenu_id)
+            .returning(*Dish.__table__.c)
+        )
         await db.commit()
-        await db.refresh(db_dish)
-        return db_dish
+        return trusted(DishModel, result.one())
 
     @staticmethod
-    async def read_dishes(db: AsyncSession, menu_id: str, submenu_id: str, skip: int = 0, limit: int = 100) -> list[DishModel]:
-        result = await db.execute(select(Dish).filter(Dish.submenu_id == submenu_id).offset(skip).limit(limit))
+    async def read_dishes(db: AsyncSession, menu_id: str, submenu_id: str, skip: int = 0, limit: int = 100,
+                          after: str | None = None) -> Sequence[Dish]:
+        stmt = paginate(select(Dish).filter(Dish.submenu_id == submenu_id), Dish.id, skip, limit, after)
+        result = await db.execute(stmt)
         return result.scalars().all()
 
+    @staticmethod
+    async def stream_dishes(db: AsyncSession, menu_id: str, submenu_id: str,
+                            batch_size: int = 500) -> AsyncIterator[Sequence[Dish]]:
+        """The submenu's dishes ordered by id, batch_size at a time through a server-side cursor."""
+        stmt = select(Dish).filter(Dish.submenu_id == submenu_id).order_by(Dish.id)\
+            .execution_options(yield_per=batch_size)
+        result = await db.stream(stmt)
+        async for dishes in result.scalars().partitions():
+            yield dishes
+
     @staticmethod
     async def read_dish(db: AsyncSession, menu_id: str, submenu_id: str, dish_id: str) -> DishModel:
         result = await db.execute(select(Dish).filter(Dish.id == dish_id, Dish.submenu_id == submenu_id))
@@ -31,24 +49,23 @@ class DishRepository:
 
     @staticmethod
     async def update_dish(db: AsyncSession, menu_id: str, submenu_id: str, dish_id: str, dish: DishCreate) -> DishModel:
-        result = await db.execute(select(Dish).filter(Dish.id == dish_id, Dish.submenu_id == submenu_id))
-        db_dish = result.scalar()
-        if not db_dish:
+        result = await db.execute(
+            update(Dish).filter(Dish.id == dish_id, Dish.submenu_id == submenu_id)
+            .values(title=dish.title, price=dish.price, description=dish.description).returning(*Dish.__table__.c)
+        )
+        db_dish = result.one_or_none()
+        if db_dish is None:
             raise HTTPException(status_code=404, detail='dish not found')
-        db_dish.title = dish.title
-        db_dish.price = dish.price
-        db_dish.description = dish.description
         await db.commit()
-        await db.refresh(db_dish)
-        return db_dish
+        return trusted(DishModel, db_dish)
 
     @staticmethod
     async def delete_dish(db: AsyncSession, menu_id: str, submenu_id: str, dish_id: str) -> dict[str, str]:
-        result = await db.execute(select(Dish).filter(Dish.id == dish_id, Dish.submenu_id == submenu_id))
-        db_dish = result.scalar()
-        if not db_dish:
+        result = cast(CursorResult, await db.execute(
+            delete(Dish).filter(Dish.id == dish_id, Dish.submenu_id == submenu_id)
+        ))
+        if result.rowcount == 0:
             raise HTTPException(status_code=404, detail='dish not found')
-        await db.delete(db_dish)
         await db.commit()
         return {'message': 'Dish deleted'}
 
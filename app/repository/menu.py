@@ -1,153 +1,166 @@
+from collections.abc import AsyncIterator, Sequence
+
 from fastapi import HTTPException
-from sqlalchemy import delete, func, select
+from sqlalchemy import (
+    JSON,
+    Text,
+    cast,
+    delete,
+    func,
+    insert,
+    literal_column,
+    select,
+    update,
+)
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.model.models import Dish, Menu, SubMenu
+from app.pagination import paginate
 from app.schema.schemas import CompleteMenu
 from app.schema.schemas import Menu as MenuModel
 from app.schema.schemas import MenuCreate
+from app.serialization import trusted
 
 
 class MenuRepository:
 
     @staticmethod
-    async def read_all_menus(db: AsyncSession, skip: int = 0, limit: int = 100) -> list[CompleteMenu]:
+    async def read_all_menus(db: AsyncSession, skip: int = 0, limit: int = 100,
+                             after: str | None = None) -> list[CompleteMenu]:
+
+        # FILTER + COALESCE so that a submenu without dishes (or a menu without submenus)
+        # gets an empty list instead of a single all-null object from the outer join;
+        # ORDER BY id inside the aggregates, as in stream_all_menus
+        empty_json_array = literal_column("'[]'::json", JSON)
 
         dishes_subquery = select(
             SubMenu.id.label('submenu_id'),
-            func.json_agg(
+            func.coalesce(func.json_agg(aggregate_order_by(
                 func.json_build_object('id', Dish.id, 'title', Dish.title, 'description',
-                                       Dish.description, 'price', Dish.price)
-            ).label('dishes')
+                                       Dish.description, 'price', Dish.price), Dish.id
+            )).filter(Dish.id.isnot(None)), empty_json_array).label('dishes')
         ).outerjoin(Dish, Dish.submenu_id == SubMenu.id)\
             .group_by(SubMenu.id).subquery()
 
         submenus_subquery = select(
             Menu.id.label('menu_id'),
-            func.json_agg(
-                func.json_build_object('id', SubMenu.id, 'title', SubMenu.title, 'description',
-                                       SubMenu.description, 'dishes', dishes_subquery.c.dishes)
-            ).label('submenus')
+            func.coalesce(func.json_agg(aggregate_order_by(
+                func.json_build_object('title', SubMenu.title, 'description', SubMenu.description,
+                                       'dishes', dishes_subquery.c.dishes), SubMenu.id
+            )).filter(SubMenu.id.isnot(None)), empty_json_array).label('submenus')
         ).outerjoin(SubMenu, SubMenu.menu_id == Menu.id)\
             .outerjoin(dishes_subquery, dishes_subquery.c.submenu_id == SubMenu.id)\
             .group_by(Menu.id).subquery()
 
+        # Rows already in the CompleteMenu shape, see app.serialization.complete_menu_dict
         stmt = select(
-            Menu,
+            Menu.title, Menu.id, Menu.description,
             submenus_subquery.c.submenus
-        ).outerjoin(submenus_subquery, submenus_subquery.c.menu_id == Menu.id)\
-            .offset(skip).limit(limit)
+        ).outerjoin(submenus_subquery, submenus_subquery.c.menu_id == Menu.id)
+        stmt = paginate(stmt, Menu.id, skip, limit, after)
 
         result = await db.execute(stmt)
-        menus_result = result.all()
+        return result.all()
 
-        menus = []
-        for menu, submenus in menus_result:
-            menu_dict = menu.__dict__
-            menu_dict['submenus'] = submenus
-            menus.append(menu_dict)
-
-        return menus
+    @staticmethod
+    async def stream_all_menus(db: AsyncSession, batch_size: int = 10) -> AsyncIterator[Sequence[str]]:
+        """
+        Every menu as its CompleteMenu JSON document, built by Postgres and fetched as
+        text through a server-side cursor, batch_size menus at a time.
+
+        The submenus and dishes are correlated subqueries of each menu row, so Postgres
+        also builds one menu at a time instead of aggregating the whole catalog first.
+        """
+        empty_json_array = literal_column("'[]'::json", JSON)
+
+        dishes = select(func.coalesce(func.json_agg(aggregate_order_by(
+            func.json_build_object('id', Dish.id, 'title', Dish.title, 'description', Dish.description,
+                                   'price', Dish.price), Dish.id
+        )), empty_json_array)).filter(Dish.submenu_id == SubMenu.id).scalar_subquery()
+
+        submenus = select(func.coalesce(func.json_agg(aggregate_order_by(
+            func.json_build_object('title', SubMenu.title, 'description', SubMenu.description, 'dishes', dishes),
+            SubMenu.id
+        )), empty_json_array)).filter(SubMenu.menu_id == Menu.id).scalar_subquery()
+
+        # Cast to text: asyncpg would otherwise decode each document into Python objects
+        stmt = select(cast(func.json_build_object('title', Menu.title, 'id', Menu.id, 'description',
+                                                  Menu.description, 'submenus', submenus), Text))\
+            .order_by(Menu.id).execution_options(yield_per=batch_size)
+
+        result = await db.stream(stmt)
+        async for menus in result.scalars().partitions():
+            yield menus
 
     @staticmethod
     async def create_menu(db: AsyncSession, menu: MenuCreate) -> MenuModel:
-
-        db_menu = Menu(title=menu.title, description=menu.description)
-        db.add(db_menu)
+        # INSERT ... RETURNING hands back the new row, server defaults included, with no refresh
+        result = await db.execute(
+            insert(Menu).values(title=menu.title, description=menu.description).returning(*Menu.__table__.c)
+        )
         await db.commit()
-        await db.refresh(db_menu)
-        return db_menu
+        return trusted(MenuModel, result.one())
 
     @staticmethod
-    async def read_menus(db: AsyncSession, skip: int = 0, limit: int = 100) -> list[MenuModel]:
-
-        submenus_subquery = select(SubMenu.menu_id, func.count(SubMenu.id).label('submenus_count'))\
-            .group_by(SubMenu.menu_id).subquery()
-
-        dishes_subquery = select(SubMenu.menu_id, func.count(Dish.id).label('dishes_count'))\
-            .join(Dish, Dish.submenu_id == SubMenu.id).group_by(SubMenu.menu_id).subquery()
-
-        stmt = select(Menu, submenus_subquery.c.submenus_count, dishes_subquery.c.dishes_count)\
-            .outerjoin(submenus_subquery, submenus_subquery.c.menu_id == Menu.id)\
-            .outerjoin(dishes_subquery, dishes_subquery.c.menu_id == Menu.id)\
-            .offset(skip).limit(limit)
-
+    async def read_menus(db: AsyncSession, skip: int = 0, limit: int = 100, after: str | None = None) -> Sequence[Menu]:
+        # submenus_count and dishes_count are stored on the row, kept up to date by triggers
+        stmt = paginate(select(Menu), Menu.id, skip, limit, after)
         result = await db.execute(stmt)
-        menus_result = result.all()
+        return result.scalars().all()
 
-        menus = []
-        for menu, submenus_count, dishes_count in menus_result:
-            menu.submenus_count = submenus_count if submenus_count else 0
-            menu.dishes_count = dishes_count if dishes_count else 0
-            menus.append(menu)
-
-        return menus
+    @staticmethod
+    async def stream_menus(db: AsyncSession, batch_size: int = 500) -> AsyncIterator[Sequence[Menu]]:
+        """Every menu ordered by id, batch_size at a time through a server-side cursor."""
+        stmt = select(Menu).order_by(Menu.id).execution_options(yield_per=batch_size)
+        result = await db.stream(stmt)
+        async for menus in result.scalars().partitions():
+            yield menus
 
     @staticmethod
     async def read_menu(db: AsyncSession, menu_id: str) -> MenuModel:
-        submenus_subquery = (
-            select(SubMenu.menu_id)
-            .add_columns(func.count(SubMenu.id).label('submenus_count'))
-            .group_by(SubMenu.menu_id)
-            .subquery()
-        )
-
-        dishes_subquery = (
-            select(SubMenu.menu_id)
-            .add_columns(func.count(Dish.id).label('dishes_count'))
-            .join(Dish, Dish.submenu_id == SubMenu.id)
-            .group_by(SubMenu.menu_id)
-            .subquery()
-        )
-
-        main_query = select(
-            Menu,
-            submenus_subquery.c.submenus_count,
-            dishes_subquery.c.dishes_count
-        ).outerjoin(
-            submenus_subquery, submenus_subquery.c.menu_id == Menu.id
-        ).outerjoin(
-            dishes_subquery, dishes_subquery.c.menu_id == Menu.id
-        ).filter(Menu.id == menu_id)
-
-        result = await db.execute(main_query)
-        result_row = result.first()
-
-        if not result_row:
+        result = await db.execute(select(Menu).filter(Menu.id == menu_id))
+        menu = result.scalar()
+        if menu is None:
             raise HTTPException(status_code=404, detail='menu not found')
-
-        menu, submenus_count, dishes_count = result_row
-        menu.submenus_count = submenus_count or 0
-        menu.dishes_count = dishes_count or 0
-
         return menu
 
+    @staticmethod
+    async def ensure_menu_exists(db: AsyncSession, menu_id: str) -> None:
+        if await db.scalar(select(Menu.id).filter(Menu.id == menu_id)) is None:
+            raise HTTPException(status_code=404, detail='menu not found')
+
     @staticmethod
     async def update_menu(db: AsyncSession, menu_id: str, menu: MenuCreate) -> MenuModel:
-        result = await db.execute(select(Menu).filter(Menu.id == menu_id))
-        db_menu = result.scalars().first()
-        if not db_menu:
+        # Empty fields are left unchanged
+        values = {var: value for var, value in menu.model_dump().items() if value}
+        if not values:
+            return await MenuRepository.read_menu(db, menu_id)
+        result = await db.execute(update(Menu).filter(Menu.id == menu_id).values(values).returning(*Menu.__table__.c))
+        db_menu = result.one_or_none()
+        if db_menu is None:
             raise HTTPException(status_code=404, detail='menu not found')
-        for var, value in menu.model_dump().items():
-            setattr(db_menu, var, value) if value else None
         await db.commit()
-        await db.refresh(db_menu)
-        return db_menu
+        return trusted(MenuModel, db_menu)
 
     @staticmethod
-    async def delete_menu(db: AsyncSession, menu_id: str) -> dict[str, str]:
-        result = await db.execute(select(Menu).filter(Menu.id == menu_id))
-        db_menu = result.scalars().first()
-        if not db_menu:
+    async def delete_menu(db: AsyncSession, menu_id: str) -> list[str]:
+        """Delete the menu; returns the ids of its submenus, deleted with it."""
+        # Submenus and dishes go with it through ON DELETE CASCADE, which runs after RETURNING has read them
+        submenu_ids = select(func.array_agg(SubMenu.id)).filter(SubMenu.menu_id == Menu.id).scalar_subquery()
+        result = await db.execute(delete(Menu).filter(Menu.id == menu_id).returning(submenu_ids))
+        deleted = result.one_or_none()
+        if deleted is None:
             raise HTTPException(status_code=404, detail='menu not found')
-        await db.delete(db_menu)
         await db.commit()
-        return {'message': 'Menu deleted'}
+        return deleted[0] or []
 
     @staticmethod
-    async def delete_all_menus(db: AsyncSession) -> dict[str, str]:
+    async def delete_all_menus(db: AsyncSession) -> tuple[list[str], list[tuple[str, str]]]:
+        """Delete everything; returns the deleted menu ids and (menu_id, submenu_id) pairs."""
         await db.execute(delete(Dish))
-        await db.execute(delete(SubMenu))
-        await db.execute(delete(Menu))
+        submenus: Sequence[tuple[str, str]] = \
+            (await db.execute(delete(SubMenu).returning(SubMenu.menu_id, SubMenu.id))).tuples().all()
+        menu_ids: Sequence[str] = (await db.execute(delete(Menu).returning(Menu.id))).scalars().all()
         await db.commit()
-        return {'message': 'All menus, submenus, and dishes have been deleted'}
+        return list(menu_ids), list(submenus)
@@ -1,103 +1,99 @@
+from collections.abc import AsyncIterator, Sequence
+from typing import cast
+
 from fastapi import HTTPException
-from sqlalchemy import delete, func, select
+from sqlalchemy import (
+    CursorResult,
+    Result,
+    Select,
+    delete,
+    insert,
+    literal,
+    select,
+    update,
+)
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.model.models import Dish, Menu, SubMenu
+from app.model.models import Menu, SubMenu
+from app.pagination import paginate
 from app.schema.schemas import SubMenu as SubMenuModel
 from app.schema.schemas import SubMenuCreate
+from app.serialization import trusted
 
 
 class SubMenuRepository:
 
     @staticmethod
     async def create_submenu(db: AsyncSession, menu_id: str, submenu: SubMenuCreate) -> SubMenuModel:
-        result = await db.execute(select(Menu).filter(Menu.id == menu_id))
-        db_menu = result.scalar_one_or_none()
-        if db_menu is None:
+        # INSERT ... SELECT FROM menus: no row is inserted (or returned) when the menu does not exist
+        menu: Select = select(literal(submenu.title), Menu.id, literal(submenu.description)).filter(Menu.id == menu_id)
+        result = await db.execute(
+            insert(SubMenu).from_select(['title', 'menu_id', 'description'], menu).returning(*SubMenu.__table__.c)
+        )
+        db_submenu = result.one_or_none()
+        if db_submenu is None:
             raise HTTPException(status_code=404, detail='Menu not found')
-        db_submenu = SubMenu(title=submenu.title, menu_id=menu_id, description=submenu.description)
-        db.add(db_submenu)
         await db.commit()
-        await db.refresh(db_submenu)
-        return db_submenu
+        return trusted(SubMenuModel, db_submenu)
 
     @staticmethod
-    async def read_submenus(db: AsyncSession, menu_id: str, skip: int = 0, limit: int = 100) -> list[SubMenuModel]:
-        dishes_subquery = select(
-            Dish.submenu_id,
-            func.count(Dish.id).label('dishes_count')
-        ).group_by(Dish.submenu_id).subquery()
-
-        stmt = select(
-            SubMenu,
-            dishes_subquery.c.dishes_count
-        ).outerjoin(
-            dishes_subquery, dishes_subquery.c.submenu_id == SubMenu.id
-        ).filter(SubMenu.menu_id == menu_id).offset(skip).limit(limit)
-
+    async def read_submenus(db: AsyncSession, menu_id: str, skip: int = 0, limit: int = 100,
+                            after: str | None = None) -> Sequence[SubMenu]:
+        # dishes_count is stored on the row, kept up to date by triggers
+        stmt = paginate(select(SubMenu).filter(SubMenu.menu_id == menu_id), SubMenu.id, skip, limit, after)
         result = await db.execute(stmt)
-        submenus_result = result.all()
+        return result.scalars().all()
 
-        submenus = []
-        for submenu, dishes_count in submenus_result:
-            submenu.dishes_count = dishes_count if dishes_count else 0
-            submenus.append(submenu)
-
-        return submenus
+    @staticmethod
+    async def stream_submenus(db: AsyncSession, menu_id: str,
+                              batch_size: int = 500) -> AsyncIterator[Sequence[SubMenu]]:
+        """The menu's submenus ordered by id, batch_size at a time through a server-side cursor."""
+        stmt = select(SubMenu).filter(SubMenu.menu_id == menu_id).order_by(SubMenu.id)\
+            .execution_options(yield_per=batch_size)
+        result = await db.stream(stmt)
+        async for submenus in result.scalars().partitions():
+            yield submenus
 
     @staticmethod
     async def read_submenu(db: AsyncSession, menu_id: str, submenu_id: str) -> SubMenuModel:
-        dishes_subquery = select(
-            Dish.submenu_id,
-            func.count(Dish.id).label('dishes_count')
-        ).group_by(Dish.submenu_id).subquery()
-
-        stmt = select(
-            SubMenu,
-            dishes_subquery.c.dishes_count
-        ).outerjoin(
-            dishes_subquery, dishes_subquery.c.submenu_id == SubMenu.id
-        ).filter(SubMenu.id == submenu_id, SubMenu.menu_id == menu_id)
-
-        result = await db.execute(stmt)
-        result_row = result.first()
-
-        if not result_row:
+        result = await db.execute(select(SubMenu).filter(SubMenu.id == submenu_id, SubMenu.menu_id == menu_id))
+        submenu = result.scalar()
+        if submenu is None:
             raise HTTPException(status_code=404, detail='submenu not found')
-
-        submenu, dishes_count = result_row
-        submenu.dishes_count = dishes_count or 0
-
         return submenu
 
+    @staticmethod
+    async def ensure_submenu_exists(db: AsyncSession, menu_id: str, submenu_id: str) -> None:
+        stmt: Select = select(SubMenu.id).filter(SubMenu.id == submenu_id, SubMenu.menu_id == menu_id)
+        if await db.scalar(stmt) is None:
+            raise HTTPException(status_code=404, detail='submenu not found')
+
     @staticmethod
     async def update_submenu(db: AsyncSession, menu_id: str, submenu_id: str, submenu: SubMenuCreate) -> SubMenuModel:
-        result = await db.execute(select(SubMenu).filter(SubMenu.id == submenu_id, SubMenu.menu_id == menu_id))
-        db_submenu = result.scalar_one_or_none()
-        if not db_submenu:
+        result = await db.execute(
+            update(SubMenu).filter(SubMenu.id == submenu_id, SubMenu.menu_id == menu_id)
+            .values(title=submenu.title, description=submenu.description).returning(*SubMenu.__table__.c)
+        )
+        db_submenu = result.one_or_none()
+        if db_submenu is None:
             raise HTTPException(status_code=404, detail='submenu not found')
-        db_submenu.title = submenu.title
-        db_submenu.description = submenu.description
         await db.commit()
-        await db.refresh(db_submenu)
-        return db_submenu
+        return trusted(SubMenuModel, db_submenu)
 
     @staticmethod
     async def delete_submenu(db: AsyncSession, menu_id: str, submenu_id: str) -> dict[str, str]:
-        result = await db.execute(select(SubMenu).filter(SubMenu.id == submenu_id, SubMenu.menu_id == menu_id))
-        db_submenu = result.scalar_one_or_none()
-        if not db_submenu:
+        # Its dishes go with it through ON DELETE CASCADE
+        result = cast(CursorResult, await db.execute(
+            delete(SubMenu).filter(SubMenu.id == submenu_id, SubMenu.menu_id == menu_id)
+        ))
+        if result.rowcount == 0:
             raise HTTPException(status_code=404, detail='submenu not found')
-        await db.execute(delete(Dish).filter(Dish.submenu_id == submenu_id))
-        await db.delete(db_submenu)
         await db.commit()
         return {'message': 'submenu deleted'}
 
     @staticmethod
-    async def delete_all_submenus(db: AsyncSession, menu_id: str) -> dict[str, str]:
-        submenus_result = await db.execute(select(SubMenu.id).filter(SubMenu.menu_id == menu_id))
-        submenu_ids = [submenu.id for submenu in submenus_result.scalars().all()]
-        await db.execute(delete(Dish).filter(Dish.submenu_id.in_(submenu_ids)))
-        await db.execute(delete(SubMenu).filter(SubMenu.menu_id == menu_id))
+    async def delete_all_submenus(db: AsyncSession, menu_id: str) -> list[str]:
+        """Delete the menu's submenus (and their dishes); returns their ids."""
+        result: Result = await db.execute(delete(SubMenu).filter(SubMenu.menu_id == menu_id).returning(SubMenu.id))
         await db.commit()
-        return {'message': 'All submenus and dishes for the given menu have been deleted'}
+        return list(result.scalars().all())
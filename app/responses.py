@@ -0,0 +1,96 @@
+import hashlib
+from typing import Any
+
+from fastapi.responses import Response, StreamingResponse
+
+from app.serialization import dumps
+
+
+class ORJSONResponse(Response):
+    """
+    Default response class of the app: bodies are encoded by app.serialization.dumps,
+    the encoder the services use for the cached payloads.
+    """
+    media_type = 'application/json'
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class CachedJSONResponse(Response):
+    """
+    A JSON body that is already encoded (as stored in the cache) and is sent as-is.
+
+    Routes returning it skip response_model validation and re-serialization;
+    the response_model is then only used for the OpenAPI schema.
+    """
+    media_type = 'application/json'
+
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+
+class NDJSONResponse(StreamingResponse):
+    """Newline-delimited JSON, one item per line, sent in chunks as the rows are fetched."""
+    media_type = NDJSON_MEDIA_TYPE
+
+
+def _accepted_qualities(accept: str) -> dict[str, float]:
+    """Media range -> q-value of an Accept header; a missing or malformed q counts as 1."""
+    qualities = {}
+    for media_range in accept.split(','):
+        media_type, *params = media_range.split(';')
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = min(max(float(value), 0.0), 1.0)
+                except ValueError:
+                    pass
+        qualities[media_type.strip().lower()] = quality
+    return qualities
+
+
+def wants_ndjson(accept: str | None) -> bool:
+    """
+    Whether an Accept header prefers NDJSON: it lists application/x-ndjson with a non-zero
+    q-value, at least as high as the one JSON gets (from application/json, else
+    application/*, else */*). Wildcards alone never select NDJSON.
+    """
+    if not accept:
+        return False
+    qualities = _accepted_qualities(accept)
+    ndjson = qualities.get(NDJSON_MEDIA_TYPE, 0.0)
+    json = next((qualities[media_range] for media_range in ('application/json', 'application/*', '*/*')
+                 if media_range in qualities), 0.0)
+    return ndjson > 0 and ndjson >= json
+
+
+def entity_tag(*parts: str) -> str:
+    """
+    Strong ETag of the representation identified by parts, e.g. its cache key. The parts
+    embed the version of the scope (see app.cache_keys), so the tag changes with the data
+    and is computed without reading the body.
+    """
+    return '"%s"' % hashlib.blake2b('\n'.join(parts).encode('utf-8'), digest_size=12).hexdigest()
+
+
+def etag_matches(if_none_match: str | None, etag: str, exists: bool = False) -> bool:
+    """
+    Whether an If-None-Match header lists etag (weak comparison, as RFC 9110 requires for it).
+
+    * matches any current representation, so it only counts with exists=True: once the
+    caller has the body or has checked the resource, a missing one must still be a 404.
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return etag in tags or (exists and '*' in tags)
+
+
+class NotModifiedResponse(Response):
+    """304 to a conditional GET; carries the ETag (and Vary) the 200 response would have had."""
+
+    def __init__(self, headers: dict[str, str]) -> None:
+        super().__init__(status_code=304, headers=headers)
@@ -1,5 +1,9 @@
+from typing import Generic, TypeVar
+
 from pydantic import BaseModel, ConfigDict
 
+T = TypeVar('T')
+
 
 class MenuBase(BaseModel):
     title: str
@@ -49,11 +53,6 @@ class DishCreate(DishBase):
 
 class DishModel(DishBase):
     id: str
-
-    @property
-    def price(self):
-        return str(round(float(self.price), 2))
-
     model_config = ConfigDict(from_attributes=True)
 
 
@@ -72,3 +71,11 @@ class CompleteMenu(BaseModel):
     id: str
     description: str
     submenus: list[SubMenuResponse]
+
+
+# ------------------------------------
+
+class Page(BaseModel, Generic[T]):
+    """A keyset page of a list endpoint, see app.pagination."""
+    items: list[T]
+    next_cursor: str | None
@@ -0,0 +1,71 @@
+"""
+The one JSON encoder of the application: cache payloads (built by the services) and
+HTTP bodies (app.responses.ORJSONResponse, the default response class) both come
+from dumps(), so a cached body is byte-for-byte what the endpoint would have sent.
+
+The *_dict encoders turn a row (ORM object or RETURNING row) into the dict of its
+response shape. Their fields are resolved once, at import, into an attrgetter, so
+encoding a row is one C call plus a zip. The tree rows of MenuRepository.read_all_menus
+carry submenus and dishes already shaped by Postgres, which are passed through as-is.
+
+Database rows are trusted output: they are encoded, or turned into response models by
+trusted(), without validation. Only request bodies are validated.
+"""
+from collections.abc import AsyncIterable, AsyncIterator, Callable, Sequence
+from operator import attrgetter
+from typing import Any, TypeVar
+
+import orjson
+from pydantic import BaseModel
+
+ModelT = TypeVar('ModelT', bound=BaseModel)
+
+MENU_FIELDS = ('id', 'title', 'description', 'submenus_count', 'dishes_count')
+SUBMENU_FIELDS = ('id', 'title', 'description', 'dishes_count')
+DISH_FIELDS = ('id', 'title', 'description', 'price')
+COMPLETE_MENU_FIELDS = ('title', 'id', 'description', 'submenus')
+
+
+def _encoder(fields: tuple[str, ...]) -> Callable[[Any], dict[str, Any]]:
+    getter = attrgetter(*fields)
+
+    def encode(row: Any) -> dict[str, Any]:
+        return dict(zip(fields, getter(row)))
+
+    return encode
+
+
+menu_dict = _encoder(MENU_FIELDS)
+submenu_dict = _encoder(SUBMENU_FIELDS)
+dish_dict = _encoder(DISH_FIELDS)
+complete_menu_dict = _encoder(COMPLETE_MENU_FIELDS)
+
+
+_model_getters: dict[type[BaseModel], tuple[tuple[str, ...], Callable]] = {}
+
+
+def trusted(model: type[ModelT], row: Any) -> ModelT:
+    """
+    model built from row's attributes with model_construct(), skipping validation.
+    FastAPI does not revalidate an instance of the route's response_model either,
+    so the row goes to the response encoder as-is.
+    """
+    if model not in _model_getters:
+        fields = tuple(model.model_fields)
+        _model_getters[model] = fields, attrgetter(*fields)
+    fields, getter = _model_getters[model]
+    return model.model_construct(**dict(zip(fields, getter(row))))
+
+
+def dumps(value: Any) -> bytes:
+    return orjson.dumps(value)
+
+
+def loads(payload: bytes | str) -> Any:
+    return orjson.loads(payload)
+
+
+async def ndjson_lines(batches: AsyncIterable[Sequence], encode: Callable[[Any], dict[str, Any]]) -> AsyncIterator[bytes]:
+    """One NDJSON chunk per batch of rows (a server-side cursor partition), a line per row."""
+    async for rows in batches:
+        yield b''.join([orjson.dumps(encode(row), option=orjson.OPT_APPEND_NEWLINE) for row in rows])
@@ -1,11 +1,27 @@
-import json
-
+from fastapi import Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.cache_manager import get_from_cache, invalidate_cache, set_in_cache
-from app.model.models import Dish as DishModel
+from app import cache_keys
+from app.cache_manager import (
+    get_or_compute,
+    get_or_revalidate,
+    get_version,
+    invalidate_many,
+)
+from app.pagination import decode_cursor, fetch_limit, page_payload
 from app.repository.dish import DishRepository
-from app.schema.schemas import DishCreate
+from app.repository.submenu import SubMenuRepository
+from app.responses import (
+    NDJSON_MEDIA_TYPE,
+    CachedJSONResponse,
+    NDJSONResponse,
+    NotModifiedResponse,
+    entity_tag,
+    etag_matches,
+)
+from app.schema.schemas import DishCreate, DishModel
+from app.serialization import dish_dict, dumps, ndjson_lines
+from config import NDJSON_BATCH_SIZE
 
 
 class DishService:
@@ -15,84 +31,81 @@ class DishService:
 
         new_dish = await DishRepository.create_dish(db, menu_id, submenu_id, dish)
 
-        cache_key = f'dishes-{menu_id}-{submenu_id}-0-100'
-        await invalidate_cache(cache_key)
-
-        cache_key_submenu = f'submenu-{menu_id}-{submenu_id}'
-        await invalidate_cache(cache_key_submenu)
-
-        cache_key_submenus_list = f'submenus-{menu_id}-0-100'
-        await invalidate_cache(cache_key_submenus_list)
-
-        cache_key_menu = f'menus-{menu_id}'
-        await invalidate_cache(cache_key_menu)
-
-        cache_key_menu_all = 'menus-0-100'
-        await invalidate_cache(cache_key_menu_all)
+        await invalidate_many(generations=[
+            cache_keys.submenu_generation(menu_id, submenu_id),
+            cache_keys.menu_generation(menu_id),
+            cache_keys.menus_generation(),
+        ])
 
         return new_dish
 
     @staticmethod
-    async def read_dishes(db: AsyncSession, menu_id: str, submenu_id: str, skip: int = 0, limit: int = 100) -> list[DishModel]:
-
-        cache_key = f'dishes-{menu_id}-{submenu_id}-{skip}-{limit}'
-        cached_dishes = await get_from_cache(cache_key)
-
-        if cached_dishes:
-            return json.loads(cached_dishes.decode('utf-8'))
-        else:
-            dishes = await DishRepository.read_dishes(db, menu_id, submenu_id, skip, limit)
-            serialized_dishes = [
-                {
-                    'id': dish.id,
-                    'title': dish.title,
-                    'description': dish.description,
-                    'price': dish.price
-                }
-                for dish in dishes
-            ]
-            json_dishes = json.dumps(serialized_dishes)
-            await set_in_cache(cache_key, json_dishes)
-
-            return dishes
+    async def read_dishes(db: AsyncSession, menu_id: str, submenu_id: str, skip: int = 0, limit: int = 100,
+                          cursor: str | None = None, if_none_match: str | None = None) -> Response:
+
+        after = decode_cursor(cursor, limit)
+        version = await get_version(cache_keys.submenu_scope(menu_id, submenu_id))
+        cache_key = cache_keys.dishes_list(menu_id, submenu_id, version, skip, limit, after)
+        headers = {'ETag': entity_tag(cache_key), 'Vary': 'Accept'}
+        # The JSON list is never a 404 (a missing submenu has no dishes), so * can match right away
+        if etag_matches(if_none_match, headers['ETag'], exists=True):
+            return NotModifiedResponse(headers)
+
+        async def load_dishes(session: AsyncSession) -> bytes:
+            dishes = await DishRepository.read_dishes(session, menu_id, submenu_id, skip, fetch_limit(limit, after), after)
+            return dumps(page_payload([dish_dict(dish) for dish in dishes], limit, after))
+
+        served_key, body = await get_or_revalidate(
+            cache_key, cache_keys.dishes_list(menu_id, submenu_id, cache_keys.LATEST, skip, limit, after),
+            cache_keys.submenu_scope(menu_id, submenu_id), load_dishes, db, family='dishes')
+        # A previous version goes out under its own ETag, which the client may already have
+        headers['ETag'] = entity_tag(served_key)
+        if etag_matches(if_none_match, headers['ETag'], exists=True):
+            return NotModifiedResponse(headers)
+        return CachedJSONResponse(body, headers=headers)
 
     @staticmethod
-    async def read_dish(db: AsyncSession, menu_id: str, submenu_id: str, dish_id: str) -> DishModel:
-
-        cache_key = f'dish-{menu_id}-{submenu_id}-{dish_id}'
-        cached_dish = await get_from_cache(cache_key)
-
-        if cached_dish:
-            return json.loads(cached_dish.decode('utf-8'))
-        else:
-            dish = await DishRepository.read_dish(db, menu_id, submenu_id, dish_id)
-            serialized_dish = {
-                'id': dish.id,
-                'title': dish.title,
-                'description': dish.description,
-                'price': dish.price
-            }
-            json_dish = json.dumps(serialized_dish)
-            await set_in_cache(cache_key, json_dish)
-
-            return dish
+    async def stream_dishes(db: AsyncSession, menu_id: str, submenu_id: str,
+                            if_none_match: str | None = None) -> Response:
+        """The submenu's dishes as NDJSON, written batch by batch from a server-side cursor. Not cached."""
+        version = await get_version(cache_keys.submenu_scope(menu_id, submenu_id))
+        headers = {'ETag': entity_tag('dishes', menu_id, submenu_id, version, NDJSON_MEDIA_TYPE), 'Vary': 'Accept'}
+        if etag_matches(if_none_match, headers['ETag']):
+            return NotModifiedResponse(headers)
+
+        # Checked up front: once the stream has started, the status can no longer change
+        await SubMenuRepository.ensure_submenu_exists(db, menu_id, submenu_id)
+        if etag_matches(if_none_match, headers['ETag'], exists=True):
+            return NotModifiedResponse(headers)
+        return NDJSONResponse(ndjson_lines(DishRepository.stream_dishes(db, menu_id, submenu_id, NDJSON_BATCH_SIZE),
+                                           dish_dict), headers=headers)
 
     @staticmethod
-    async def update_dish(db: AsyncSession, menu_id: str, submenu_id: str, dish_id: str, dish: DishCreate) -> DishModel:
+    async def read_dish(db: AsyncSession, menu_id: str, submenu_id: str, dish_id: str,
+                        if_none_match: str | None = None) -> Response:
 
-        updated_dish = await DishRepository.update_dish(db, menu_id, submenu_id, dish_id, dish)
+        version = await get_version(cache_keys.submenu_scope(menu_id, submenu_id))
+        cache_key = cache_keys.dish(menu_id, submenu_id, dish_id, version)
+        headers = {'ETag': entity_tag(cache_key)}
+        if etag_matches(if_none_match, headers['ETag']):
+            return NotModifiedResponse(headers)
 
-        cache_key = f'dish-{menu_id}-{submenu_id}-{dish_id}'
-        await invalidate_cache(cache_key)
+        async def load_dish(session: AsyncSession) -> bytes:
+            dish = await DishRepository.read_dish(session, menu_id, submenu_id, dish_id)
+            return dumps(dish_dict(dish))
 
-        cache_key = f'dishes-{menu_id}-{submenu_id}-0-100'
-        await invalidate_cache(cache_key)
+        body = await get_or_compute(cache_key, load_dish, db, family='dish')
+        # If-None-Match: * only once the dish is known to exist, else it must stay a 404
+        if etag_matches(if_none_match, headers['ETag'], exists=True):
+            return NotModifiedResponse(headers)
+        return CachedJSONResponse(body, headers=headers)
 
-        cache_key_submenu = f'submenu-{menu_id}-{submenu_id}'
-        await invalidate_cache(cache_key_submenu)
+    @staticmethod
+    async def update_dish(db: AsyncSession, menu_id: str, submenu_id: str, dish_id: str, dish: DishCreate) -> DishModel:
 
-        cache_key_menu = f'menus-{menu_id}'
-        await invalidate_cache(cache_key_menu)
+        updated_dish = await DishRepository.update_dish(db, menu_id, submenu_id, dish_id, dish)
+
+        await invalidate_many(generations=[cache_keys.submenu_generation(menu_id, submenu_id)])
 
         return updated_dish
 
@@ -101,23 +114,11 @@ class DishService:
 
         deleted_dish = await DishRepository.delete_dish(db, menu_id, submenu_id, dish_id)
 
-        cache_key_dish = f'dish-{menu_id}-{submenu_id}-{dish_id}'
-        await invalidate_cache(cache_key_dish)
-
-        cache_key_dishes = f'dishes-{menu_id}-{submenu_id}-0-100'
-        await invalidate_cache(cache_key_dishes)
-
-        cache_key_submenu = f'submenu-{menu_id}-{submenu_id}'
-        await invalidate_cache(cache_key_submenu)
-
-        cache_key_submenus = f'submenus-{menu_id}-0-100'
-        await invalidate_cache(cache_key_submenus)
-
-        cache_key_menu = f'menus-{menu_id}'
-        await invalidate_cache(cache_key_menu)
-
-        cache_key_menu_all = 'menus-0-100'
-        await invalidate_cache(cache_key_menu_all)
+        await invalidate_many(generations=[
+            cache_keys.submenu_generation(menu_id, submenu_id),
+            cache_keys.menu_generation(menu_id),
+            cache_keys.menus_generation(),
+        ])
 
         return deleted_dish
 
@@ -126,16 +127,10 @@ class DishService:
 
         deleted_dishes = await DishRepository.delete_all_dishes(db, menu_id, submenu_id)
 
-        cache_key_dishes = f'dishes-{menu_id}-{submenu_id}-0-100'
-        await invalidate_cache(cache_key_dishes)
-
-        cache_key_submenu = f'submenus-{menu_id}-0-100'
-        await invalidate_cache(cache_key_submenu)
-
-        cache_key_menu = f'menus-{menu_id}'
-        await invalidate_cache(cache_key_menu)
-
-        cache_key_menu_all = 'menus-0-100'
-        await invalidate_cache(cache_key_menu_all)
+        await invalidate_many(generations=[
+            cache_keys.submenu_generation(menu_id, submenu_id),
+            cache_keys.menu_generation(menu_id),
+            cache_keys.menus_generation(),
+        ])
 
         return deleted_dishes
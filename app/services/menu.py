@@ -1,12 +1,30 @@
-import json
 import logging
+from collections.abc import AsyncIterator
 
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.cache_manager import get_from_cache, invalidate_cache, set_in_cache
-from app.model.models import Menu as MenuModel
+from app import cache_keys
+from app.cache_manager import (
+    get_or_compute,
+    get_or_revalidate,
+    get_version,
+    invalidate_many,
+)
+from app.pagination import decode_cursor, fetch_limit, page_payload
 from app.repository.menu import MenuRepository
-from app.schema.schemas import CompleteMenu, MenuCreate
+from app.responses import (
+    NDJSON_MEDIA_TYPE,
+    CachedJSONResponse,
+    NDJSONResponse,
+    NotModifiedResponse,
+    entity_tag,
+    etag_matches,
+)
+from app.schema.schemas import Menu as MenuModel
+from app.schema.schemas import MenuCreate
+from app.serialization import complete_menu_dict, dumps, menu_dict, ndjson_lines
+from config import NDJSON_BATCH_SIZE, TREE_STREAM_BATCH_SIZE
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -14,111 +32,140 @@ logging.basicConfig(level=logging.DEBUG)
 class MenuService:
 
     @staticmethod
-    async def read_all_menus(db: AsyncSession, skip: int = 0, limit: int = 100) -> list[CompleteMenu]:
-        menus = await MenuRepository.read_all_menus(db, skip, limit)
-        return menus
+    async def read_all_menus(db: AsyncSession, skip: int = 0, limit: int = 100, cursor: str | None = None,
+                             if_none_match: str | None = None) -> Response:
+        after = decode_cursor(cursor, limit)
+        version = await get_version(cache_keys.tree_scope())
+        cache_key = cache_keys.tree(version, skip, limit, after)
+        headers = {'ETag': entity_tag(cache_key), 'Vary': 'Accept'}
+        if etag_matches(if_none_match, headers['ETag'], exists=True):
+            return NotModifiedResponse(headers)
 
-    @staticmethod
-    async def create_menu(db: AsyncSession, menu: MenuCreate) -> MenuModel:
-        new_menu = await MenuRepository.create_menu(db, menu)
-        cache_key = 'menus-0-100'
-        await invalidate_cache(cache_key)
+        async def load_tree(session: AsyncSession) -> bytes:
+            menus = await MenuRepository.read_all_menus(session, skip, fetch_limit(limit, after), after)
+            return dumps(page_payload([complete_menu_dict(menu) for menu in menus], limit, after))
 
-        return new_menu
+        return CachedJSONResponse(await get_or_compute(cache_key, load_tree, db, family='tree'), headers=headers)
 
     @staticmethod
-    async def read_menus(db: AsyncSession, skip: int = 0, limit: int = 100) -> list[MenuModel]:
-        cache_key = f'menus-{skip}-{limit}'
-
-        cached_menus = await get_from_cache(cache_key)
-
-        if cached_menus:
-            logging.debug(f"Cache hit for key {cache_key}: {cached_menus.decode('utf-8')}")
-            return json.loads(cached_menus.decode('utf-8'))
-
-        menus = await MenuRepository.read_menus(db, skip, limit)
-
-        serialized_menus = [
-            {
-                'id': menu.id,
-                'title': menu.title,
-                'description': menu.description,
-                'submenus_count': menu.submenus_count,
-                'dishes_count': menu.dishes_count
-            }
-            for menu in menus
-        ]
-
-        json_menus = json.dumps(serialized_menus)
-        await set_in_cache(cache_key, json_menus)
-
-        return menus
+    async def stream_all_menus(db: AsyncSession, ndjson: bool = False, if_none_match: str | None = None) -> Response:
+        """
+        The whole tree as one JSON array (or NDJSON, a menu per line), streamed in
+        chunks as Postgres builds it.
+
+        Each menu arrives from the database as finished JSON text and is written out
+        unparsed, so memory stays flat whatever the size of the catalog. Not cached:
+        the body is never held in one piece.
+        """
+        version = await get_version(cache_keys.tree_scope())
+        headers = {'ETag': entity_tag('tree', version, NDJSON_MEDIA_TYPE if ndjson else 'stream'), 'Vary': 'Accept'}
+        if etag_matches(if_none_match, headers['ETag'], exists=True):
+            return NotModifiedResponse(headers)
+
+        async def body() -> AsyncIterator[bytes]:
+            separator = b'['
+            async for menus in MenuRepository.stream_all_menus(db, TREE_STREAM_BATCH_SIZE):
+                yield separator + ','.join(menus).encode('utf-8')
+                separator = b','
+            yield b']' if separator == b',' else b'[]'
+
+        async def lines() -> AsyncIterator[bytes]:
+            async for menus in MenuRepository.stream_all_menus(db, TREE_STREAM_BATCH_SIZE):
+                yield ''.join([f'{menu}\n' for menu in menus]).encode('utf-8')
+
+        if ndjson:
+            return NDJSONResponse(lines(), headers=headers)
+        return StreamingResponse(body(), media_type='application/json', headers=headers)
 
     @staticmethod
-    async def read_menu(db: AsyncSession, menu_id: str) -> MenuModel:
-        cache_key = f'menus-{menu_id}'
-
-        cached_menu = await get_from_cache(cache_key)
+    async def stream_menus(db: AsyncSession, if_none_match: str | None = None) -> Response:
+        """Every menu as NDJSON, written batch by batch as the server-side cursor yields them. Not cached."""
+        version = await get_version(cache_keys.menus_scope())
+        headers = {'ETag': entity_tag('menus', version, NDJSON_MEDIA_TYPE), 'Vary': 'Accept'}
+        if etag_matches(if_none_match, headers['ETag'], exists=True):
+            return NotModifiedResponse(headers)
 
-        if cached_menu:
-            logging.debug(f"Cache hit for key {cache_key}: {cached_menu.decode('utf-8')}")
-            return json.loads(cached_menu.decode('utf-8'))
-        else:
-            logging.debug(f'Cache miss for key {cache_key}')
+        return NDJSONResponse(ndjson_lines(MenuRepository.stream_menus(db, NDJSON_BATCH_SIZE), menu_dict),
+                              headers=headers)
 
-        menu = await MenuRepository.read_menu(db, menu_id)
-
-        serialized_menu = {
-            'id': menu.id,
-            'title': menu.title,
-            'description': menu.description,
-            'submenus_count': menu.submenus_count,
-            'dishes_count': menu.dishes_count
-        }
+    @staticmethod
+    async def create_menu(db: AsyncSession, menu: MenuCreate) -> MenuModel:
+        new_menu = await MenuRepository.create_menu(db, menu)
+        await invalidate_many(generations=[cache_keys.menus_generation()])
 
-        json_menu = json.dumps(serialized_menu)
+        return new_menu
 
-        await set_in_cache(cache_key, json_menu)
+    @staticmethod
+    async def read_menus(db: AsyncSession, skip: int = 0, limit: int = 100, cursor: str | None = None,
+                         if_none_match: str | None = None) -> Response:
+        after = decode_cursor(cursor, limit)
+        version = await get_version(cache_keys.menus_scope())
+        cache_key = cache_keys.menus_list(version, skip, limit, after)
+        headers = {'ETag': entity_tag(cache_key), 'Vary': 'Accept'}
+        if etag_matches(if_none_match, headers['ETag'], exists=True):
+            return NotModifiedResponse(headers)
+
+        async def load_menus(session: AsyncSession) -> bytes:
+            menus = await MenuRepository.read_menus(session, skip, fetch_limit(limit, after), after)
+            return dumps(page_payload([menu_dict(menu) for menu in menus], limit, after))
+
+        served_key, body = await get_or_revalidate(
+            cache_key, cache_keys.menus_list(cache_keys.LATEST, skip, limit, after),
+            cache_keys.menus_scope(), load_menus, db, family='menus')
+        # A previous version goes out under its own ETag, which the client may already have
+        headers['ETag'] = entity_tag(served_key)
+        if etag_matches(if_none_match, headers['ETag'], exists=True):
+            return NotModifiedResponse(headers)
+        return CachedJSONResponse(body, headers=headers)
 
-        return menu
+    @staticmethod
+    async def read_menu(db: AsyncSession, menu_id: str, if_none_match: str | None = None) -> Response:
+        version = await get_version(cache_keys.menu_scope(menu_id))
+        cache_key = cache_keys.menu(menu_id, version)
+        headers = {'ETag': entity_tag(cache_key)}
+        if etag_matches(if_none_match, headers['ETag']):
+            return NotModifiedResponse(headers)
+
+        async def load_menu(session: AsyncSession) -> bytes:
+            menu = await MenuRepository.read_menu(session, menu_id)
+            return dumps(menu_dict(menu))
+
+        served_key, body = await get_or_revalidate(cache_key, cache_keys.menu(menu_id, cache_keys.LATEST),
+                                                   cache_keys.menu_scope(menu_id), load_menu, db, family='menu')
+        # If-None-Match: * only once the menu is known to exist, else it must stay a 404;
+        # a previous version goes out under its own ETag, which the client may already have
+        headers['ETag'] = entity_tag(served_key)
+        if etag_matches(if_none_match, headers['ETag'], exists=True):
+            return NotModifiedResponse(headers)
+        return CachedJSONResponse(body, headers=headers)
 
     @staticmethod
     async def update_menu(db: AsyncSession, menu_id: str, menu: MenuCreate) -> MenuModel:
 
         updated_menu = await MenuRepository.update_menu(db, menu_id, menu)
 
-        serialized_menu = {
-            'id': updated_menu.id,
-            'title': updated_menu.title,
-            'description': updated_menu.description
-        }
-        json_menu = json.dumps(serialized_menu)
-
-        cache_key_menu = f'menus-{menu_id}'
-        await set_in_cache(cache_key_menu, json_menu)
-
-        cache_key_list = 'menus-0-100'
-        await invalidate_cache(cache_key_list)
+        await invalidate_many(generations=[cache_keys.menu_generation(menu_id), cache_keys.menus_generation()])
 
         return updated_menu
 
     @staticmethod
     async def delete_menu(db: AsyncSession, menu_id: str) -> dict[str, str]:
-        deleted_menu = await MenuRepository.delete_menu(db, menu_id)
-
-        cache_key = f'menus-{menu_id}'
-        await invalidate_cache(cache_key)
+        submenu_ids = await MenuRepository.delete_menu(db, menu_id)
 
-        cache_key = 'menus-0-100'
-        await invalidate_cache(cache_key)
+        await invalidate_many(generations=[cache_keys.menus_generation()],
+                              retired=[cache_keys.menu_generation(menu_id),
+                                       *(cache_keys.submenu_generation(menu_id, submenu_id) for submenu_id in submenu_ids)])
 
-        return deleted_menu
+        return {'message': 'Menu deleted'}
 
     @staticmethod
     async def delete_all_menus(db: AsyncSession) -> dict[str, str]:
 
-        deleted_menus = await MenuRepository.delete_all_menus(db)
+        menu_ids, submenus = await MenuRepository.delete_all_menus(db)
 
-        await invalidate_cache('menus-0-100')
+        await invalidate_many(generations=[cache_keys.catalog_generation(), cache_keys.menus_generation()],
+                              retired=[*(cache_keys.menu_generation(menu_id) for menu_id in menu_ids),
+                                       *(cache_keys.submenu_generation(menu_id, submenu_id)
+                                         for menu_id, submenu_id in submenus)])
 
-        return deleted_menus
+        return {'message': 'All menus, submenus, and dishes have been deleted'}
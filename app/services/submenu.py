@@ -1,12 +1,28 @@
-import json
-import logging
-
+from fastapi import Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.cache_manager import get_from_cache, invalidate_cache, set_in_cache
-from app.model.models import SubMenu as SubMenuModel
+from app import cache_keys
+from app.cache_manager import (
+    get_or_compute,
+    get_or_revalidate,
+    get_version,
+    invalidate_many,
+)
+from app.pagination import decode_cursor, fetch_limit, page_payload
+from app.repository.menu import MenuRepository
 from app.repository.submenu import SubMenuRepository
+from app.responses import (
+    NDJSON_MEDIA_TYPE,
+    CachedJSONResponse,
+    NDJSONResponse,
+    NotModifiedResponse,
+    entity_tag,
+    etag_matches,
+)
+from app.schema.schemas import SubMenu as SubMenuModel
 from app.schema.schemas import SubMenuCreate
+from app.serialization import dumps, ndjson_lines, submenu_dict
+from config import NDJSON_BATCH_SIZE
 
 
 class SubMenuService:
@@ -16,94 +32,75 @@ class SubMenuService:
 
         new_submenu = await SubMenuRepository.create_submenu(db, menu_id, submenu)
 
-        cache_key_list = f'submenus-{menu_id}-0-100'
-        await invalidate_cache(cache_key_list)
-
-        cache_key_menu = f'menus-{menu_id}'
-        await invalidate_cache(cache_key_menu)
-
-        cache_key_all = 'menus-0-100'
-        await invalidate_cache(cache_key_all)
+        await invalidate_many(generations=[cache_keys.menu_generation(menu_id), cache_keys.menus_generation()])
 
         return new_submenu
 
     @staticmethod
-    async def read_submenus(db: AsyncSession, menu_id: str, skip: int = 0, limit: int = 100) -> list[SubMenuModel]:
-        cache_key = f'submenus-{menu_id}-{skip}-{limit}'
-
-        cached_submenus = await get_from_cache(cache_key)
-
-        if cached_submenus:
-            logging.debug(f"Cache hit for key {cache_key}: {cached_submenus.decode('utf-8')}")
-            return json.loads(cached_submenus.decode('utf-8'))
-        else:
-            logging.debug(f'Cache miss for key {cache_key}')
-
-        submenus = await SubMenuRepository.read_submenus(db, menu_id, skip, limit)
-
-        serialized_submenus = [
-            {
-                'id': submenu.id,
-                'title': submenu.title,
-                'description': submenu.description,
-                'dishes_count': submenu.dishes_count
-            }
-            for submenu in submenus
-        ]
-
-        json_submenus = json.dumps(serialized_submenus)
-        logging.debug(f'Serialized submenu: {json_submenus}')
-        await set_in_cache(cache_key, json_submenus)
-
-        return submenus
+    async def read_submenus(db: AsyncSession, menu_id: str, skip: int = 0, limit: int = 100,
+                            cursor: str | None = None, if_none_match: str | None = None) -> Response:
+        after = decode_cursor(cursor, limit)
+        version = await get_version(cache_keys.menu_scope(menu_id))
+        cache_key = cache_keys.submenus_list(menu_id, version, skip, limit, after)
+        headers = {'ETag': entity_tag(cache_key), 'Vary': 'Accept'}
+        # The JSON list is never a 404 (a missing menu has no submenus), so * can match right away
+        if etag_matches(if_none_match, headers['ETag'], exists=True):
+            return NotModifiedResponse(headers)
+
+        async def load_submenus(session: AsyncSession) -> bytes:
+            submenus = await SubMenuRepository.read_submenus(session, menu_id, skip, fetch_limit(limit, after), after)
+            return dumps(page_payload([submenu_dict(submenu) for submenu in submenus], limit, after))
+
+        served_key, body = await get_or_revalidate(
+            cache_key, cache_keys.submenus_list(menu_id, cache_keys.LATEST, skip, limit, after),
+            cache_keys.menu_scope(menu_id), load_submenus, db, family='submenus')
+        # A previous version goes out under its own ETag, which the client may already have
+        headers['ETag'] = entity_tag(served_key)
+        if etag_matches(if_none_match, headers['ETag'], exists=True):
+            return NotModifiedResponse(headers)
+        return CachedJSONResponse(body, headers=headers)
 
     @staticmethod
-    async def read_submenu(db: AsyncSession, menu_id: str, submenu_id: str) -> SubMenuModel:
-
-        cache_key = f'submenu-{menu_id}-{submenu_id}'
+    async def stream_submenus(db: AsyncSession, menu_id: str, if_none_match: str | None = None) -> Response:
+        """The menu's submenus as NDJSON, written batch by batch from a server-side cursor. Not cached."""
+        version = await get_version(cache_keys.menu_scope(menu_id))
+        headers = {'ETag': entity_tag('submenus', menu_id, version, NDJSON_MEDIA_TYPE), 'Vary': 'Accept'}
+        if etag_matches(if_none_match, headers['ETag']):
+            return NotModifiedResponse(headers)
+
+        # Checked up front: once the stream has started, the status can no longer change
+        await MenuRepository.ensure_menu_exists(db, menu_id)
+        if etag_matches(if_none_match, headers['ETag'], exists=True):
+            return NotModifiedResponse(headers)
+        return NDJSONResponse(ndjson_lines(SubMenuRepository.stream_submenus(db, menu_id, NDJSON_BATCH_SIZE),
+                                           submenu_dict), headers=headers)
 
-        cached_submenu = await get_from_cache(cache_key)
-
-        if cached_submenu:
-            logging.debug(f"Cache hit for key {cache_key}: {cached_submenu.decode('utf-8')}")
-            return json.loads(cached_submenu.decode('utf-8'))
-        else:
-            logging.debug(f'Cache miss for key {cache_key}')
-
-        submenu = await SubMenuRepository.read_submenu(db, menu_id, submenu_id)
+    @staticmethod
+    async def read_submenu(db: AsyncSession, menu_id: str, submenu_id: str,
+                           if_none_match: str | None = None) -> Response:
 
-        serialized_submenu = {
-            'id': submenu.id,
-            'title': submenu.title,
-            'description': submenu.description,
-            'dishes_count': submenu.dishes_count
-        }
+        version = await get_version(cache_keys.menu_scope(menu_id))
+        cache_key = cache_keys.submenu(menu_id, submenu_id, version)
+        headers = {'ETag': entity_tag(cache_key)}
+        if etag_matches(if_none_match, headers['ETag']):
+            return NotModifiedResponse(headers)
 
-        json_submenu = json.dumps(serialized_submenu)
-        logging.debug(f'Serialized submenu: {json_submenu}')
-        await set_in_cache(cache_key, json_submenu)
+        async def load_submenu(session: AsyncSession) -> bytes:
+            submenu = await SubMenuRepository.read_submenu(session, menu_id, submenu_id)
+            return dumps(submenu_dict(submenu))
 
-        return submenu
+        body = await get_or_compute(cache_key, load_submenu, db, family='submenu')
+        # If-None-Match: * only once the submenu is known to exist, else it must stay a 404
+        if etag_matches(if_none_match, headers['ETag'], exists=True):
+            return NotModifiedResponse(headers)
+        return CachedJSONResponse(body, headers=headers)
 
     @staticmethod
     async def update_submenu(db: AsyncSession, menu_id: str, submenu_id: str, submenu: SubMenuCreate) -> SubMenuModel:
 
         updated_submenu = await SubMenuRepository.update_submenu(db, menu_id, submenu_id, submenu)
 
-        cache_key_list = f'submenus-{menu_id}-0-100'
-        await invalidate_cache(cache_key_list)
-
-        cache_key_menu = f'menus-{menu_id}'
-        await invalidate_cache(cache_key_menu)
-
-        serialized_submenu = {
-            'id': updated_submenu.id,
-            'title': updated_submenu.title,
-            'description': updated_submenu.description
-        }
-        cache_key_single = f'submenu-{menu_id}-{submenu_id}'
-        json_submenu = json.dumps(serialized_submenu)
-        await set_in_cache(cache_key_single, json_submenu)
+        await invalidate_many(generations=[cache_keys.menu_generation(menu_id)])
 
         return updated_submenu
 
@@ -111,28 +108,16 @@ class SubMenuService:
     async def delete_submenu(db: AsyncSession, menu_id: str, submenu_id: str) -> dict[str, str]:
         deleted_submenu = await SubMenuRepository.delete_submenu(db, menu_id, submenu_id)
 
-        cache_key_single = f'submenu-{menu_id}-{submenu_id}'
-        await invalidate_cache(cache_key_single)
-
-        cache_key_list = f'submenus-{menu_id}-0-100'
-        await invalidate_cache(cache_key_list)
-
-        cache_key_menu = f'menus-{menu_id}'
-        await invalidate_cache(cache_key_menu)
-
-        cache_key_menu_all = 'menus-0-100'
-        await invalidate_cache(cache_key_menu_all)
+        await invalidate_many(generations=[cache_keys.menu_generation(menu_id), cache_keys.menus_generation()],
+                              retired=[cache_keys.submenu_generation(menu_id, submenu_id)])
 
         return deleted_submenu
 
     @staticmethod
     async def delete_all_submenus(db: AsyncSession, menu_id: str) -> dict[str, str]:
-        deleted_submenus = await SubMenuRepository.delete_all_submenus(db, menu_id)
-
-        cache_key_list = f'submenus-{menu_id}-0-100'
-        await invalidate_cache(cache_key_list)
+        submenu_ids = await SubMenuRepository.delete_all_submenus(db, menu_id)
 
-        cache_key_menu_all = 'menus-0-100'
-        await invalidate_cache(cache_key_menu_all)
+        await invalidate_many(generations=[cache_keys.menu_generation(menu_id), cache_keys.menus_generation()],
+                              retired=[cache_keys.submenu_generation(menu_id, submenu_id) for submenu_id in submenu_ids])
 
-        return deleted_submenus
+        return {'message': 'All submenus and dishes for the given menu have been deleted'}
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import threading
+from collections.abc import Callable, Coroutine
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, TypeVar
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+
+from app.cache_manager import close_redis, get_redis_connection, init_redis
+from config import WORKER_PARSE_THREADS
+from db.config import DatabaseSettings
+from db.database import create_engine_for
+
+T = TypeVar('T')
+
+
+class WorkerRuntime:
+    """
+    Event loop, database engine and Redis pool owned by one Celery worker process.
+
+    The loop runs forever in a background thread, so the engine and Redis pools it
+    owns are reused by every task the process runs; tasks hand it coroutines with run().
+    Blocking work (parsing a menu file) goes to a thread pool through run_blocking(),
+    which keeps the loop free for Redis and database I/O meanwhile.
+    """
+
+    def __init__(self, parse_threads: int = WORKER_PARSE_THREADS) -> None:
+        self.parse_threads = parse_threads
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.engine: AsyncEngine | None = None
+        self._sessionmaker: async_sessionmaker[AsyncSession] | None = None
+        self.ready = False
+        self._thread: threading.Thread | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self.loop is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            self._executor = ThreadPoolExecutor(max_workers=self.parse_threads, thread_name_prefix='menu-parse')
+            self._thread = threading.Thread(target=self.loop.run_forever, name='worker-runtime', daemon=True)
+            self._thread.start()
+        self.run(self._open())
+        logging.info('Worker runtime started.')
+
+    async def _open(self) -> None:
+        # Its own engine and pool, sized for one sync at a time (WORKER_DB_* variables, see db.config)
+        self.engine = create_engine_for(DatabaseSettings.from_env('worker'))
+        self._sessionmaker = async_sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        await init_redis()
+
+    def stop(self) -> None:
+        with self._lock:
+            if self.loop is None or self._thread is None or self._executor is None:
+                return
+            loop, self.loop = self.loop, None
+        asyncio.run_coroutine_threadsafe(self._close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join()
+        loop.close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.ready = False
+        logging.info('Worker runtime stopped.')
+
+    async def _close(self) -> None:
+        # E.g. the readiness probe started by celery_worker.start_runtime, if still waiting
+        pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        await close_redis()
+        if self.engine is not None:
+            await self.engine.dispose()
+
+    def submit(self, coroutine: Coroutine[Any, Any, T]) -> Future[T]:
+        """Schedule a coroutine on the runtime loop without waiting for it."""
+        if self.loop is None:
+            raise RuntimeError('Worker runtime is not started')
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine: Coroutine[Any, Any, T], timeout: float | None = None) -> T:
+        """Run a coroutine on the runtime loop and wait for its result from the calling thread."""
+        return self.submit(coroutine).result(timeout)
+
+    def session(self) -> AsyncSession:
+        """A new session on the runtime's engine."""
+        if self._sessionmaker is None:
+            raise RuntimeError('Worker runtime is not started')
+        return self._sessionmaker()
+
+    async def run_blocking(self, func: Callable[..., T], *args: Any) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def probe(self) -> bool:
+        """Check that Postgres answers a query and Redis a PING."""
+        if self.engine is None:
+            raise RuntimeError('Worker runtime is not started')
+        try:
+            async with self.engine.connect() as connection:
+                await connection.execute(text('SELECT 1'))
+            await (await get_redis_connection()).ping()
+        except Exception as e:
+            logging.info(f'Worker dependencies not ready: {e!r}')
+            self.ready = False
+        else:
+            self.ready = True
+        return self.ready
+
+    async def wait_until_ready(self, timeout: float) -> bool:
+        """Probe with exponential backoff until Postgres and Redis answer or timeout passes."""
+        deadline = asyncio.get_running_loop().time() + timeout
+        delay = 0.5
+        while not await self.probe():
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                logging.warning(f'Postgres or Redis still not ready after {timeout}s')
+                return False
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, 5.0)
+        return True
+
+
+runtime = WorkerRuntime()
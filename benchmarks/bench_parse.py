@@ -0,0 +1,135 @@
+"""
+Parse time and peak RSS of the menu spreadsheet parser on a generated ~100k-row workbook.
+
+Compares the previous parser (load_workbook in full mode, every cell object built
+and styled in memory) with the streaming read-only parser, and the CSV and NDJSON
+inputs of the same catalog. Every parser runs in a fresh process so peak RSS
+is not shared between them.
+
+    python -m benchmarks.bench_parse
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from collections.abc import Callable, Iterator
+
+from openpyxl import Workbook, load_workbook
+
+from benchmarks.generate import generate_menus
+from tools.parse_excel import iter_menus
+
+
+def legacy_parse_menu_excel(file_path: str) -> list[dict]:
+    workbook = load_workbook(filename=file_path)
+    sheet = workbook.active
+
+    menus = []
+    current_menu = None
+    current_submenu = None
+
+    for row in sheet.iter_rows():
+        if row[0].value:
+            current_menu = {'id': row[0].value, 'title': row[1].value, 'description': row[2].value, 'submenus': []}
+            menus.append(current_menu)
+            current_submenu = None
+            continue
+
+        if current_menu is None:
+            continue
+
+        if row[1].value:
+            current_submenu = {'id': row[1].value, 'title': row[2].value, 'description': row[3].value, 'dishes': []}
+            current_menu['submenus'].append(current_submenu)
+            continue
+
+        if row[2].value and current_submenu:
+            dish_price = float(row[5].value) if len(row) > 5 and row[5].value else None
+            dish_discount = float(row[6].value) if len(row) > 6 and row[6].value else None
+            current_submenu['dishes'].append({'id': row[2].value, 'title': row[3].value, 'description': row[4].value,
+                                              'price': str(dish_price), 'discount': dish_discount})
+
+    return menus
+
+
+def streaming_parse(file_path: str) -> int:
+    # Consume menu by menu, as synchronize_menus does, without keeping the parsed tree
+    return sum(1 for _ in iter_menus(file_path))
+
+
+def catalog_rows(menus: list[dict]) -> Iterator[tuple]:
+    for menu in menus:
+        yield menu['id'], menu['title'], menu['description'], None, None, None, None
+        for submenu in menu['submenus']:
+            yield None, submenu['id'], submenu['title'], submenu['description'], None, None, None
+            for dish in submenu['dishes']:
+                yield None, None, dish['id'], dish['title'], dish['description'], float(dish['price']), dish['discount']
+
+
+def write_inputs(directory: str, menus: list[dict]) -> dict[str, str]:
+    paths = {suffix: os.path.join(directory, f'menu.{suffix}') for suffix in ('xlsx', 'csv', 'ndjson')}
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    for row in catalog_rows(menus):
+        sheet.append(row)
+    workbook.save(paths['xlsx'])
+
+    with open(paths['csv'], 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows(catalog_rows(menus))
+
+    with open(paths['ndjson'], 'w', encoding='utf-8') as f:
+        for menu in menus:
+            f.write(json.dumps(menu, ensure_ascii=False) + '\n')
+
+    return paths
+
+
+def measure(parse: Callable[[str], object], file_path: str, results: multiprocessing.Queue) -> None:
+    started = time.perf_counter()
+    parse(file_path)
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((elapsed, peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024))
+
+
+def run(parse: Callable[[str], object], file_path: str) -> tuple[float, float]:
+    # Spawned, not forked, so the child does not start with the generator's memory
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=measure, args=(parse, file_path, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--menus', type=int, default=20)
+    parser.add_argument('--submenus', type=int, default=50)
+    parser.add_argument('--dishes', type=int, default=100)
+    args = parser.parse_args()
+
+    menus = generate_menus(args.menus, args.submenus, args.dishes)
+    rows = args.menus * (1 + args.submenus * (1 + args.dishes))
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_inputs(directory, menus)
+        print(f'{rows} rows, {os.path.getsize(paths["xlsx"]) / 1024 / 1024:.1f} MiB workbook')
+
+        for name, parse, file_path in (('xlsx, full load (old)', legacy_parse_menu_excel, paths['xlsx']),
+                                       ('xlsx, read-only stream', streaming_parse, paths['xlsx']),
+                                       ('csv stream', streaming_parse, paths['csv']),
+                                       ('ndjson stream', streaming_parse, paths['ndjson'])):
+            elapsed, peak_mib = run(parse, file_path)
+            print(f'{name:>24}: {elapsed:7.2f}s  peak RSS {peak_mib:8.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Serialize/deserialize throughput of a 10k-dish CompleteMenu tree (GET /api/v1/menu)
+and of a 10k-row menus page (GET /api/v1/menus).
+
+Compares the previous path (pydantic validation + dump_json for the tree, hand-built
+dicts + json.dumps for the pages, json.loads to decode) with app.serialization.
+
+    python -m benchmarks.bench_serialization
+"""
+import argparse
+import json
+import time
+from collections import namedtuple
+from collections.abc import Callable
+
+from pydantic import TypeAdapter
+
+from app.schema.schemas import CompleteMenu, Page
+from app.serialization import (
+    COMPLETE_MENU_FIELDS,
+    MENU_FIELDS,
+    complete_menu_dict,
+    dumps,
+    loads,
+    menu_dict,
+)
+from benchmarks.generate import generate_menus
+
+complete_menus_adapter = TypeAdapter(list[CompleteMenu] | Page[CompleteMenu])
+
+TreeRow = namedtuple('TreeRow', 'title id description submenus')
+MenuRow = namedtuple('MenuRow', 'id title description submenus_count dishes_count')
+assert TreeRow._fields == COMPLETE_MENU_FIELDS and MenuRow._fields == MENU_FIELDS
+
+
+def legacy_tree(menus: list[dict]) -> bytes:
+    return complete_menus_adapter.dump_json(complete_menus_adapter.validate_python(menus))
+
+
+def legacy_menus(menus: list) -> bytes:
+    serialized_menus = [
+        {
+            'id': menu.id,
+            'title': menu.title,
+            'description': menu.description,
+            'submenus_count': menu.submenus_count,
+            'dishes_count': menu.dishes_count
+        }
+        for menu in menus
+    ]
+    return json.dumps(serialized_menus).encode('utf-8')
+
+
+def throughput(func: Callable, arg, seconds: float) -> tuple[float, int]:
+    """Calls per second of func(arg) over about seconds, and the size of its last result."""
+    calls, started = 0, time.perf_counter()
+    while True:
+        result = func(arg)
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= seconds:
+            return calls / elapsed, len(result) if isinstance(result, bytes) else 0
+
+
+def report(name: str, legacy: tuple[float, int], current: tuple[float, int], size: int) -> None:
+    print(f'{name:>22}: {legacy[0]:8,.1f} -> {current[0]:8,.1f} ops/s '
+          f'({current[0] / legacy[0]:.1f}x, {size * current[0] / 2 ** 20:,.0f} MiB/s)')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--menus', type=int, default=10)
+    parser.add_argument('--submenus', type=int, default=10)
+    parser.add_argument('--dishes', type=int, default=100, help='dishes per submenu')
+    parser.add_argument('--rows', type=int, default=10000, help='rows of the menus page')
+    parser.add_argument('--seconds', type=float, default=2.0, help='per measurement')
+    args = parser.parse_args()
+
+    catalog = generate_menus(args.menus, args.submenus, args.dishes)
+    # Rows as MenuRepository.read_all_menus returns them: Postgres built the nested JSON
+    tree_rows = [
+        TreeRow(menu['title'], menu['id'], menu['description'], [
+            {'title': submenu['title'], 'description': submenu['description'],
+             'dishes': [{key: dish[key] for key in ('id', 'title', 'description', 'price')}
+                        for dish in submenu['dishes']]}
+            for submenu in menu['submenus']
+        ])
+        for menu in catalog
+    ]
+    # ... and as it returned them before: menu.__dict__ plus the aggregated submenus
+    legacy_rows = [{**row._asdict(), 'submenus_count': args.submenus, 'dishes_count': args.submenus * args.dishes,
+                    '_sa_instance_state': object()} for row in tree_rows]
+    menu_rows = [MenuRow(f'id-{index}', f'Menu {index}', 'Menu description', 3, 12) for index in range(args.rows)]
+
+    tree = dumps([complete_menu_dict(row) for row in tree_rows])
+    assert loads(tree) == loads(legacy_tree(legacy_rows))
+    print(f'tree: {args.menus * args.submenus * args.dishes} dishes, {len(tree) / 2 ** 20:.1f} MiB; '
+          f'menus page: {args.rows} rows')
+
+    report('serialize tree', throughput(legacy_tree, legacy_rows, args.seconds),
+           throughput(lambda rows: dumps([complete_menu_dict(row) for row in rows]), tree_rows, args.seconds),
+           len(tree))
+    report('deserialize tree', throughput(json.loads, tree, args.seconds),
+           throughput(loads, tree, args.seconds), len(tree))
+
+    page = dumps([menu_dict(row) for row in menu_rows])
+    report('serialize menus page', throughput(legacy_menus, menu_rows, args.seconds),
+           throughput(lambda rows: dumps([menu_dict(row) for row in rows]), menu_rows, args.seconds), len(page))
+    report('deserialize menus page', throughput(json.loads, page, args.seconds),
+           throughput(loads, page, args.seconds), len(page))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+import uuid
+
+
+def generate_menus(menus: int = 50, submenus: int = 20, dishes: int = 50) -> list[dict]:
+    """
+    Build a catalog shaped like tools.parse_excel.parse_menu_excel output
+    (menus * submenus * dishes dishes in total).
+    """
+    result = []
+    for menu_index in range(menus):
+        menu: dict = {'id': str(uuid.uuid4()), 'title': f'Menu {menu_index}',
+                      'description': f'Menu {menu_index} description', 'submenus': []}
+        for submenu_index in range(submenus):
+            submenu: dict = {'id': str(uuid.uuid4()), 'title': f'Submenu {menu_index}.{submenu_index}',
+                             'description': f'Submenu {submenu_index} description', 'dishes': []}
+            for dish_index in range(dishes):
+                submenu['dishes'].append({
+                    'id': str(uuid.uuid4()), 'title': f'Dish {menu_index}.{submenu_index}.{dish_index}',
+                    'description': f'Dish {dish_index} description', 'price': str(float(100 + dish_index)),
+                    'discount': 0.1 if dish_index % 10 == 0 else None,
+                })
+            menu['submenus'].append(submenu)
+        result.append(menu)
+    return result
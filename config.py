@@ -2,3 +2,54 @@ REDIS_HOST = 'redis'
 REDIS_PORT = 6379
 REDIS_DB = 0
 REDIS_PASSWORD = None
+
+# Shared connection pool used by app.cache_manager
+REDIS_MAX_CONNECTIONS = 50
+REDIS_POOL_TIMEOUT = 5  # seconds to wait for a free connection before failing
+REDIS_SOCKET_TIMEOUT = 2.0
+REDIS_SOCKET_CONNECT_TIMEOUT = 2.0
+REDIS_HEALTH_CHECK_INTERVAL = 30
+
+# In-process (L1) cache in front of Redis, see app.cache_manager.LocalCache
+L1_CACHE_MAX_ENTRIES = 10000
+L1_CACHE_TTL = 60  # seconds, for immutable versioned payloads
+L1_GENERATION_TTL = 5  # seconds, upper bound on staleness of a generation counter if an invalidation is missed
+CACHE_INVALIDATION_CHANNEL = 'menuapp:invalidations'
+
+# Single-flight on cache misses, see app.cache_manager.get_or_compute
+CACHE_DISTRIBUTED_LOCK = True  # also coalesce misses across workers with a short Redis lock
+CACHE_LOCK_LEASE = 5.0  # seconds; after this a waiting worker computes the value itself
+CACHE_LOCK_POLL_INTERVAL = 0.05
+
+# (soft, hard) TTLs in seconds per cache key family, see app.cache_manager.get_or_compute.
+# Redis drops an entry left unread for the hard TTL; a read past the soft TTL stores it again
+# in the background. Cached keys embed their scope's version, so an entry never goes stale.
+# The pages read through get_or_revalidate (menus, menu, submenus, dishes) also keep serving
+# the previous version, up to its hard TTL, while the one after an invalidation is computed.
+CACHE_TTLS = {
+    'default': (600, 3600),
+    'menus': (300, 3600),
+    'menu': (600, 3600),
+    'submenus': (300, 3600),
+    'submenu': (600, 3600),
+    'dishes': (300, 3600),
+    'dish': (600, 3600),
+    'tree': (600, 3600),
+}
+# Counters of deleted menus and submenus expire after this many seconds, well past the TTL
+# of any entry cached under them, see app.cache_manager.invalidate_many
+CACHE_RETIRED_GENERATION_TTL = 86400
+
+# Celery worker runtime, see app.worker_runtime
+WORKER_READY_TIMEOUT = 60  # seconds a new worker process keeps probing Postgres and Redis in the background
+WORKER_PARSE_THREADS = 1  # threads parsing menu files off the worker event loop
+
+# Menu file sync scheduling, see tools.sync_scheduler
+SYNC_LOCK_LEASE = 60  # seconds; renewed by a heartbeat while the sync runs
+SYNC_MIN_INTERVAL = 5  # seconds between checks right after a change (and the beat period)
+SYNC_MAX_INTERVAL = 300  # upper bound of the backoff while the file stays unchanged
+SYNC_BACKOFF_FACTOR = 2
+
+# Streamed list responses: GET /api/v1/menu?stream=true and Accept: application/x-ndjson, see app.services
+TREE_STREAM_BATCH_SIZE = 10  # menus (each with all its dishes) fetched per round trip of the cursor and sent per chunk
+NDJSON_BATCH_SIZE = 500  # rows fetched per round trip of the server-side cursor and sent per chunk
@@ -0,0 +1,79 @@
+"""
+Engine and pool settings, read from environment variables.
+
+Every setting can be set for all engines (DB_POOL_SIZE) or for one role only
+(API_DB_POOL_SIZE, WORKER_DB_POOL_SIZE); the role-specific variable wins. The API
+serves many short concurrent requests and gets a larger pool than a Celery worker
+process, which runs one menu sync at a time. WORKER_DATABASE_URL lets the worker
+connect elsewhere than DATABASE_URL, e.g. directly to Postgres instead of PgBouncer.
+
+DB_PGBOUNCER=1 makes the engine safe behind PgBouncer in transaction pooling mode:
+prepared statements are not cached and get unique names (a server connection may
+serve another client between two transactions), and the statement timeout is
+enforced client-side since PgBouncer rejects it as a startup parameter.
+"""
+import os
+from dataclasses import dataclass
+from typing import Any
+from uuid import uuid4
+
+ROLE_DEFAULTS: dict[str, dict[str, Any]] = {
+    'api': {'pool_size': 10, 'max_overflow': 20},
+    # A full menu sync is a few bulk statements, each of which may legitimately run long
+    'worker': {'pool_size': 2, 'max_overflow': 0, 'statement_timeout': 0},
+}
+
+
+def _env(role: str, name: str) -> str | None:
+    return os.getenv(f'{role.upper()}_{name}', os.getenv(name))
+
+
+def _flag(value: str) -> bool:
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+@dataclass(frozen=True)
+class DatabaseSettings:
+    url: str | None
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30.0  # seconds to wait for a free connection before TimeoutError
+    pool_recycle: int = 1800  # seconds; older connections are replaced on checkout, -1 keeps them
+    pool_pre_ping: bool = True
+    statement_timeout: int = 30000  # milliseconds, 0 disables it
+    statement_cache_size: int = 100  # prepared statements cached per connection
+    pgbouncer: bool = False
+
+    @classmethod
+    def from_env(cls, role: str) -> 'DatabaseSettings':
+        """Settings of the engine used by role ('api' or 'worker')."""
+        values: dict[str, Any] = dict(ROLE_DEFAULTS.get(role, {}))
+        for name, convert in (('pool_size', int), ('max_overflow', int), ('pool_timeout', float),
+                              ('pool_recycle', int), ('pool_pre_ping', _flag), ('statement_timeout', int),
+                              ('statement_cache_size', int), ('pgbouncer', _flag)):
+            value = _env(role, f'DB_{name.upper()}')
+            if value is not None:
+                values[name] = convert(value)
+        return cls(url=_env(role, 'DATABASE_URL'), **values)
+
+    def engine_options(self) -> dict[str, Any]:
+        """Keyword arguments of create_async_engine for these settings."""
+        connect_args: dict[str, Any] = {}
+        if self.pgbouncer:
+            connect_args['prepared_statement_cache_size'] = 0
+            connect_args['statement_cache_size'] = 0
+            connect_args['prepared_statement_name_func'] = lambda: f'__asyncpg_{uuid4()}__'
+            if self.statement_timeout:
+                connect_args['command_timeout'] = self.statement_timeout / 1000
+        else:
+            connect_args['prepared_statement_cache_size'] = self.statement_cache_size
+            if self.statement_timeout:
+                connect_args['server_settings'] = {'statement_timeout': str(self.statement_timeout)}
+        return {
+            'pool_size': self.pool_size,
+            'max_overflow': self.max_overflow,
+            'pool_timeout': self.pool_timeout,
+            'pool_recycle': self.pool_recycle,
+            'pool_pre_ping': self.pool_pre_ping,
+            'connect_args': connect_args,
+        }
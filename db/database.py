@@ -1,10 +1,77 @@
-import os
+import time
+from typing import cast
 
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy import exc
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-DATABASE_URL = os.getenv('DATABASE_URL')
-engine = create_async_engine(DATABASE_URL)
-SessionLocal = async_sessionmaker(autocommit=False, autoflush=False, bind=engine)
+from db.config import DatabaseSettings
+
+
+class PoolStats:
+    """Checkout counters of one InstrumentedPool, kept across pool re-creation (engine.dispose())."""
+
+    def __init__(self) -> None:
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, wait: float) -> None:
+        self.checkouts += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that times every checkout: waiting for a free connection, opening an
+    overflow connection and the pre-ping are all time a request spends before its
+    first query.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
 
-# Base.metadata.drop_all(bind=engine)
-# Base.metadata.create_all(bind=engine)
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.stats.timeouts += 1
+            raise
+        self.stats.record(time.perf_counter() - started)
+        return connection
+
+    def recreate(self) -> 'InstrumentedPool':
+        pool = cast(InstrumentedPool, super().recreate())
+        pool.stats = self.stats
+        return pool
+
+
+def create_engine_for(settings: DatabaseSettings) -> AsyncEngine:
+    return create_async_engine(settings.url, poolclass=InstrumentedPool, **settings.engine_options())
+
+
+def pool_stats(engine: AsyncEngine) -> dict[str, float]:
+    """Current usage and cumulative checkout statistics of engine's pool."""
+    pool = cast(InstrumentedPool, engine.pool)  # always, see create_engine_for
+    stats = pool.stats
+    return {
+        'size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'checked_in': pool.checkedin(),
+        'overflow': max(pool.overflow(), 0),
+        'max_overflow': pool._max_overflow,
+        'checkouts': stats.checkouts,
+        'timeouts': stats.timeouts,
+        'wait_seconds_total': round(stats.wait_total, 6),
+        'wait_seconds_max': round(stats.wait_max, 6),
+    }
+
+
+settings = DatabaseSettings.from_env('api')
+DATABASE_URL = settings.url
+engine = create_engine_for(settings)
+SessionLocal = async_sessionmaker(autocommit=False, autoflush=False, bind=engine)
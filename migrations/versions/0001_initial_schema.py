@@ -0,0 +1,51 @@
+"""Initial schema, as previously created by Base.metadata.create_all at startup
+
+Databases created that way already have it: mark them with `alembic stamp 0001`
+before the first `alembic upgrade head`.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = '0001'
+down_revision: str | None = None
+branch_labels: str | None = None
+depends_on: str | None = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'menus',
+        sa.Column('id', sa.String(), primary_key=True),
+        sa.Column('title', sa.String()),
+        sa.Column('description', sa.String()),
+    )
+    op.create_index('ix_menus_id', 'menus', ['id'])
+
+    op.create_table(
+        'submenus',
+        sa.Column('id', sa.String(), primary_key=True),
+        sa.Column('title', sa.String()),
+        sa.Column('menu_id', sa.String(), sa.ForeignKey('menus.id', ondelete='CASCADE')),
+        sa.Column('description', sa.String()),
+    )
+    op.create_index('ix_submenus_id', 'submenus', ['id'])
+
+    op.create_table(
+        'dishes',
+        sa.Column('id', sa.String(), primary_key=True),
+        sa.Column('title', sa.String()),
+        sa.Column('price', sa.String()),
+        sa.Column('submenu_id', sa.String(), sa.ForeignKey('submenus.id', ondelete='CASCADE')),
+        sa.Column('description', sa.String()),
+    )
+    op.create_index('ix_dishes_id', 'dishes', ['id'])
+
+
+def downgrade() -> None:
+    op.drop_table('dishes')
+    op.drop_table('submenus')
+    op.drop_table('menus')
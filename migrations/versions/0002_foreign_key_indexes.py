@@ -0,0 +1,36 @@
+"""Index the foreign keys, drop the indexes duplicating the primary keys
+
+(menu_id, id) and (submenu_id, id) serve the per-parent lookups, pages and counts,
+and the ON DELETE CASCADE scans of the child tables. ix_<table>_id duplicated the
+primary key index and only slowed down writes.
+
+The indexes are built CONCURRENTLY, so the tables stay writable meanwhile.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision: str = '0002'
+down_revision: str | None = '0001'
+branch_labels: str | None = None
+depends_on: str | None = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_submenus_menu_id_id', 'submenus', ['menu_id', 'id'],
+                        postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_dishes_submenu_id_id', 'dishes', ['submenu_id', 'id'],
+                        postgresql_concurrently=True, if_not_exists=True)
+        for table in ('menus', 'submenus', 'dishes'):
+            op.drop_index(f'ix_{table}_id', table_name=table, postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for table in ('menus', 'submenus', 'dishes'):
+            op.create_index(f'ix_{table}_id', table, ['id'], postgresql_concurrently=True, if_not_exists=True)
+        op.drop_index('ix_dishes_submenu_id_id', table_name='dishes', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_submenus_menu_id_id', table_name='submenus', postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,121 @@
+"""Store submenus_count and dishes_count on menus and submenus, maintained by triggers
+
+Statement-level AFTER triggers with transition tables apply one grouped delta per
+statement, so bulk writes (tools.synchronization, delete_all_*) cost one UPDATE per
+parent table rather than one per row. They cover every write path, ON CONFLICT
+upserts and ON DELETE CASCADE included: a cascaded dish delete finds its submenu
+already gone and leaves the menu alone, since the submenu delete subtracts the
+submenu's whole dishes_count from its menu.
+
+tools/reconcile_counts.py recomputes the counters if they ever drift.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = '0003'
+down_revision: str | None = '0002'
+branch_labels: str | None = None
+depends_on: str | None = None
+
+DISH_DELTAS = {
+    'INSERT': 'SELECT submenu_id, count(*) AS delta FROM new_rows GROUP BY submenu_id',
+    'DELETE': 'SELECT submenu_id, -count(*) AS delta FROM old_rows GROUP BY submenu_id',
+    'UPDATE': '''
+        SELECT submenu_id, sum(delta) AS delta FROM (
+            SELECT n.submenu_id, 1 AS delta FROM new_rows n JOIN old_rows o USING (id)
+            WHERE n.submenu_id IS DISTINCT FROM o.submenu_id
+            UNION ALL
+            SELECT o.submenu_id, -1 FROM new_rows n JOIN old_rows o USING (id)
+            WHERE n.submenu_id IS DISTINCT FROM o.submenu_id
+        ) moves GROUP BY submenu_id''',
+}
+
+SUBMENU_DELTAS = {
+    'INSERT': '''SELECT menu_id, count(*) AS submenus, sum(dishes_count) AS dishes
+                 FROM new_rows GROUP BY menu_id''',
+    'DELETE': '''SELECT menu_id, -count(*) AS submenus, -sum(dishes_count) AS dishes
+                 FROM old_rows GROUP BY menu_id''',
+    'UPDATE': '''
+        SELECT menu_id, sum(submenus) AS submenus, sum(dishes) AS dishes FROM (
+            SELECT n.menu_id, 1 AS submenus, n.dishes_count AS dishes FROM new_rows n JOIN old_rows o USING (id)
+            WHERE n.menu_id IS DISTINCT FROM o.menu_id
+            UNION ALL
+            SELECT o.menu_id, -1, -o.dishes_count FROM new_rows n JOIN old_rows o USING (id)
+            WHERE n.menu_id IS DISTINCT FROM o.menu_id
+        ) moves GROUP BY menu_id''',
+}
+
+
+def _dish_function(operation: str) -> str:
+    return f'''
+        CREATE FUNCTION dishes_count_{operation.lower()}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            WITH deltas AS ({DISH_DELTAS[operation]}),
+            submenu_deltas AS (
+                UPDATE submenus SET dishes_count = submenus.dishes_count + deltas.delta
+                FROM deltas WHERE submenus.id = deltas.submenu_id AND deltas.delta <> 0
+                RETURNING submenus.menu_id, deltas.delta
+            )
+            UPDATE menus SET dishes_count = menus.dishes_count + menu_deltas.delta
+            FROM (SELECT menu_id, sum(delta) AS delta FROM submenu_deltas GROUP BY menu_id) menu_deltas
+            WHERE menus.id = menu_deltas.menu_id;
+            RETURN NULL;
+        END $$'''
+
+
+def _submenu_function(operation: str) -> str:
+    return f'''
+        CREATE FUNCTION submenus_count_{operation.lower()}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE menus SET submenus_count = menus.submenus_count + deltas.submenus,
+                             dishes_count = menus.dishes_count + deltas.dishes
+            FROM ({SUBMENU_DELTAS[operation]}) deltas
+            WHERE menus.id = deltas.menu_id AND (deltas.submenus <> 0 OR deltas.dishes <> 0);
+            RETURN NULL;
+        END $$'''
+
+
+def _trigger(table: str, function: str, operation: str) -> str:
+    transition = {'INSERT': 'NEW TABLE AS new_rows', 'DELETE': 'OLD TABLE AS old_rows',
+                  'UPDATE': 'NEW TABLE AS new_rows OLD TABLE AS old_rows'}[operation]
+    return f'''
+        CREATE TRIGGER {function}_{operation.lower()} AFTER {operation} ON {table}
+        REFERENCING {transition} FOR EACH STATEMENT EXECUTE FUNCTION {function}_{operation.lower()}()'''
+
+
+def upgrade() -> None:
+    op.add_column('menus', sa.Column('submenus_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('menus', sa.Column('dishes_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('submenus', sa.Column('dishes_count', sa.Integer(), nullable=False, server_default='0'))
+
+    op.execute('''
+        UPDATE submenus SET dishes_count = counts.dishes_count
+        FROM (SELECT submenu_id, count(*) AS dishes_count FROM dishes GROUP BY submenu_id) counts
+        WHERE submenus.id = counts.submenu_id''')
+    op.execute('''
+        UPDATE menus SET submenus_count = counts.submenus_count, dishes_count = counts.dishes_count
+        FROM (SELECT menu_id, count(*) AS submenus_count, sum(dishes_count) AS dishes_count
+              FROM submenus GROUP BY menu_id) counts
+        WHERE menus.id = counts.menu_id''')
+
+    for operation in ('INSERT', 'DELETE', 'UPDATE'):
+        op.execute(_dish_function(operation))
+        op.execute(_trigger('dishes', 'dishes_count', operation))
+        op.execute(_submenu_function(operation))
+        op.execute(_trigger('submenus', 'submenus_count', operation))
+
+
+def downgrade() -> None:
+    for operation in ('INSERT', 'DELETE', 'UPDATE'):
+        op.execute(f'DROP TRIGGER dishes_count_{operation.lower()} ON dishes')
+        op.execute(f'DROP FUNCTION dishes_count_{operation.lower()}()')
+        op.execute(f'DROP TRIGGER submenus_count_{operation.lower()} ON submenus')
+        op.execute(f'DROP FUNCTION submenus_count_{operation.lower()}()')
+
+    op.drop_column('submenus', 'dishes_count')
+    op.drop_column('menus', 'dishes_count')
+    op.drop_column('menus', 'submenus_count')
@@ -1,17 +1,23 @@
+import asyncio
+import json
 import logging
 import os
 
 import httpx
 import pytest
 
+from app import cache_keys, cache_manager
 from app.main import app
+from config import CACHE_RETIRED_GENERATION_TTL
 from url_reverser import URLReverser  # Custom class defined in url_reverser in root dir
 
 DATABASE_URL = os.getenv('DATABASE_URL')
 logging.basicConfig(level=logging.DEBUG)
 
+# The tests share one event loop: the app's engine and Redis pools outlive a single test
 
-@pytest.mark.asyncio
+
+@pytest.mark.asyncio(loop_scope='module')
 async def test_endpoint() -> None:
     async with httpx.AsyncClient(app=app, base_url='http://localhost:8000') as client:
         reverser = URLReverser(app)
@@ -20,7 +26,7 @@ async def test_endpoint() -> None:
         assert response.status_code == 200
 
 
-@pytest.mark.asyncio
+@pytest.mark.asyncio(loop_scope='module')
 async def test_crud_menu_and_submenus() -> None:
     async with httpx.AsyncClient(app=app, base_url='http://localhost:8000') as client:
         # Create menu
@@ -76,18 +82,18 @@ async def test_crud_menu_and_submenus() -> None:
 
         # Verify the number of submenus
         assert len(menu['submenus']) == 3
-        k = 0
-        # Iterate through the submenus to verify their details
+        dish_titles = []
+        # Iterate through the submenus to verify their details; they are listed by id,
+        # not in creation order
         for submenu in menu['submenus']:
             assert submenu['title'] == 'Test Submenu'
             assert submenu['description'] == 'This is a test submenu'
 
             # Check the number of dishes in each submenu
             assert len(submenu['dishes']) == 2
-            for i in range(2):
-
-                assert submenu['dishes'][i]['title'] == f'Test Dish {k}'
-            k += 1
+            assert submenu['dishes'][0]['title'] == submenu['dishes'][1]['title']
+            dish_titles.append(submenu['dishes'][0]['title'])
+        assert sorted(dish_titles) == [f'Test Dish {k}' for k in range(3)]
 
     # -------------------------
         # Update a dish
@@ -134,3 +140,244 @@ async def test_crud_menu_and_submenus() -> None:
         # Check that the menu no longer exists
         response = await client.get(f'/api/v1/menus/{menu_id}')
         assert response.status_code == 404
+
+
+@pytest.mark.asyncio(loop_scope='module')
+async def test_keyset_pagination() -> None:
+    async with httpx.AsyncClient(app=app, base_url='http://localhost:8000') as client:
+        response = await client.post('/api/v1/menus', json={'title': 'Paged Menu', 'description': 'Paged'})
+        menu_id = response.json()['id']
+        submenu_ids = []
+        for i in range(5):
+            response = await client.post(f'/api/v1/menus/{menu_id}/submenus',
+                                         json={'title': f'Submenu {i}', 'description': 'Paged'})
+            submenu_ids.append(response.json()['id'])
+
+        # Walk the pages: ordered by id, no duplicates, no gaps
+        seen: list[str] = []
+        cursor = ''
+        while cursor is not None:
+            response = await client.get(f'/api/v1/menus/{menu_id}/submenus', params={'cursor': cursor, 'limit': 2})
+            assert response.status_code == 200
+            page = response.json()
+            assert len(page['items']) <= 2
+            seen.extend(submenu['id'] for submenu in page['items'])
+            cursor = page['next_cursor']
+        assert seen == sorted(submenu_ids)
+
+        # skip is ignored with a cursor, so a page requested with one cannot differ from
+        # (nor be cached in place of) the same page requested without
+        for params in ({'cursor': '', 'skip': 3, 'limit': 3}, {'cursor': '', 'limit': 3}):
+            response = await client.get(f'/api/v1/menus/{menu_id}/submenus', params=params)
+            assert [submenu['id'] for submenu in response.json()['items']] == sorted(submenu_ids)[:3]
+
+        # A keyset page needs a positive limit; skip/limit mode keeps taking limit=0
+        for limit in (0, -1):
+            response = await client.get(f'/api/v1/menus/{menu_id}/submenus', params={'cursor': '', 'limit': limit})
+            assert response.status_code == 422
+        response = await client.get(f'/api/v1/menus/{menu_id}/submenus', params={'limit': 0})
+        assert response.status_code == 200
+        assert response.json() == []
+
+        # skip/limit keeps returning a plain list, in the same order
+        response = await client.get(f'/api/v1/menus/{menu_id}/submenus', params={'skip': 2, 'limit': 2})
+        assert [submenu['id'] for submenu in response.json()] == sorted(submenu_ids)[2:4]
+
+        response = await client.get(f'/api/v1/menus/{menu_id}/submenus', params={'cursor': '%%%'})
+        assert response.status_code == 400
+
+        response = await client.delete(f'/api/v1/menus/{menu_id}')
+        assert response.status_code == 200
+
+
+@pytest.mark.asyncio(loop_scope='module')
+async def test_metrics_report_pool_usage() -> None:
+    async with httpx.AsyncClient(app=app, base_url='http://localhost:8000') as client:
+        await client.get('/api/v1/menus')
+        pool = (await client.get('/metrics')).json()['db_pool']
+
+    assert pool['checked_out'] == 0
+    assert pool['checkouts'] >= 1
+    assert pool['wait_seconds_max'] >= 0
+
+
+@pytest.mark.asyncio(loop_scope='module')
+async def test_writes_to_missing_rows_return_404() -> None:
+    async with httpx.AsyncClient(app=app, base_url='http://localhost:8000') as client:
+        menu = {'title': 'Menu', 'description': 'Menu description'}
+        response = await client.post('/api/v1/menus', json=menu)
+        menu_id = response.json()['id']
+        response = await client.post(f'/api/v1/menus/{menu_id}/submenus', json=menu)
+        submenu_id = response.json()['id']
+        dish = {'title': 'Dish', 'description': 'Dish description', 'price': '10.50'}
+
+        assert (await client.post('/api/v1/menus/missing/submenus', json=menu)).status_code == 404
+        assert (await client.patch('/api/v1/menus/missing', json=menu)).status_code == 404
+        assert (await client.patch(f'/api/v1/menus/missing/submenus/{submenu_id}', json=menu)).status_code == 404
+        dishes_url = f'/api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes'
+        assert (await client.patch(f'{dishes_url}/missing', json=dish)).status_code == 404
+        assert (await client.delete(f'{dishes_url}/missing')).status_code == 404
+        assert (await client.delete(f'/api/v1/menus/missing/submenus/{submenu_id}')).status_code == 404
+
+        assert (await client.delete(f'/api/v1/menus/{menu_id}')).status_code == 200
+        assert (await client.delete(f'/api/v1/menus/{menu_id}')).status_code == 404
+
+
+@pytest.mark.asyncio(loop_scope='module')
+async def test_streamed_tree_matches_buffered_tree() -> None:
+    async with httpx.AsyncClient(app=app, base_url='http://localhost:8000') as client:
+        menu = {'title': 'Streamed menu', 'description': 'Menu description'}
+        menu_id = (await client.post('/api/v1/menus', json=menu)).json()['id']
+        # Several submenus and dishes: both must list them in id order, not in whatever
+        # order the aggregate happened to see them
+        for _ in range(3):
+            submenu_id = (await client.post(f'/api/v1/menus/{menu_id}/submenus', json=menu)).json()['id']
+            for _ in range(3):
+                await client.post(f'/api/v1/menus/{menu_id}/submenus/{submenu_id}/dishes',
+                                  json={'title': 'Dish', 'description': 'Dish description', 'price': '10.50'})
+        await client.post('/api/v1/menus', json={'title': 'Empty menu', 'description': ''})
+
+        streamed = await client.get('/api/v1/menu', params={'stream': True})
+        buffered = await client.get('/api/v1/menu', params={'limit': 1000})
+
+        assert streamed.status_code == 200
+        assert streamed.headers['content-type'] == 'application/json'
+        assert streamed.json() == buffered.json()
+
+
+@pytest.mark.asyncio(loop_scope='module')
+async def test_list_endpoints_stream_ndjson() -> None:
+    ndjson = {'Accept': 'application/x-ndjson'}
+    async with httpx.AsyncClient(app=app, base_url='http://localhost:8000') as client:
+        menu = {'title': 'NDJSON menu', 'description': 'Menu description'}
+        menu_id = (await client.post('/api/v1/menus', json=menu)).json()['id']
+        submenus_url = f'/api/v1/menus/{menu_id}/submenus'
+        submenu_id = (await client.post(submenus_url, json=menu)).json()['id']
+        dishes_url = f'{submenus_url}/{submenu_id}/dishes'
+        for price in ('10.50', '11.50'):
+            await client.post(dishes_url, json={'title': 'Dish', 'description': 'Dish description', 'price': price})
+
+        # The tree is compared with ?stream=true, built by the same query
+        for url, params in (('/api/v1/menus', {'limit': 1000}), (submenus_url, {}), (dishes_url, {}),
+                            ('/api/v1/menu', {'stream': True})):
+            streamed = await client.get(url, headers=ndjson)
+            buffered = await client.get(url, params=params)
+
+            assert streamed.status_code == 200
+            assert streamed.headers['content-type'] == 'application/x-ndjson'
+            lines = streamed.text.splitlines()
+            assert streamed.text.endswith('\n')
+            assert sorted((json.loads(line) for line in lines), key=lambda item: item['id']) == \
+                sorted(buffered.json(), key=lambda item: item['id'])
+
+        # q=0 means not acceptable, and JSON wins when the client prefers it
+        for accept in ('application/x-ndjson;q=0', 'application/json, application/x-ndjson;q=0.5'):
+            response = await client.get(submenus_url, headers={'Accept': accept})
+            assert response.headers['content-type'] == 'application/json'
+
+        # A missing parent is a 404 before any line is streamed; the JSON lists keep answering []
+        for url in ('/api/v1/menus/missing/submenus', f'{submenus_url}/missing/dishes',
+                    f'/api/v1/menus/missing/submenus/{submenu_id}/dishes'):
+            assert (await client.get(url, headers=ndjson)).status_code == 404
+        for url in ('/api/v1/menus/missing/submenus', f'{submenus_url}/missing/dishes'):
+            response = await client.get(url)
+            assert response.status_code == 200
+            assert response.json() == []
+
+        assert (await client.delete(f'/api/v1/menus/{menu_id}')).status_code == 200
+
+
+@pytest.mark.asyncio(loop_scope='module')
+async def test_conditional_get_answers_304_until_a_write() -> None:
+    async with httpx.AsyncClient(app=app, base_url='http://localhost:8000') as client:
+        menu = {'title': 'ETag menu', 'description': 'Menu description'}
+        menu_id = (await client.post('/api/v1/menus', json=menu)).json()['id']
+        submenus_url = f'/api/v1/menus/{menu_id}/submenus'
+        submenu_id = (await client.post(submenus_url, json=menu)).json()['id']
+        dishes_url = f'{submenus_url}/{submenu_id}/dishes'
+        dish_id = (await client.post(dishes_url, json={'title': 'Dish', 'description': 'd', 'price': '1.50'})).json()['id']
+
+        urls = ['/api/v1/menu', '/api/v1/menus', f'/api/v1/menus/{menu_id}', submenus_url,
+                f'{submenus_url}/{submenu_id}', dishes_url, f'{dishes_url}/{dish_id}']
+        for url in urls:
+            await client.get(url)
+        # Lists cached by earlier tests first answer with their previous version while it is computed again
+        await asyncio.gather(*cache_manager._refreshing.values())
+        etags = {}
+        for url in urls:
+            response = await client.get(url)
+            assert response.status_code == 200
+            etags[url] = response.headers['etag']
+            assert etags[url].startswith('"')
+        ndjson_etag = (await client.get(dishes_url, headers={'Accept': 'application/x-ndjson'})).headers['etag']
+        assert ndjson_etag != etags[dishes_url]
+
+        checkouts = (await client.get('/metrics')).json()['db_pool']['checkouts']
+        for url in urls:
+            response = await client.get(url, headers={'If-None-Match': etags[url]})
+            assert response.status_code == 304
+            assert response.headers['etag'] == etags[url]
+            assert response.content == b''
+        assert (await client.get(dishes_url, headers={'Accept': 'application/x-ndjson',
+                                                      'If-None-Match': f'"other", W/{ndjson_etag}'})).status_code == 304
+        # Answered from the version counters alone
+        assert (await client.get('/metrics')).json()['db_pool']['checkouts'] == checkouts
+
+        # A new price changes the dish, its list and the tree; the menus and submenus are still current
+        await client.patch(f'{dishes_url}/{dish_id}', json={'title': 'Dish', 'description': 'd', 'price': '2.50'})
+        for url in urls:
+            response = await client.get(url, headers={'If-None-Match': etags[url]})
+            assert response.status_code == (200 if url in ('/api/v1/menu', f'{dishes_url}/{dish_id}') else 304)
+            assert response.headers['etag'] == etags[url] or response.status_code == 200
+        # The list still served its previous version, under that version's ETag, while it was computed again
+        await asyncio.gather(*cache_manager._refreshing.values())
+        response = await client.get(dishes_url, headers={'If-None-Match': etags[dishes_url]})
+        assert response.status_code == 200
+        assert response.json()[0]['price'] == '2.50'
+
+        # * matches whatever exists, and only that: a missing resource is still a 404
+        for url in urls:
+            assert (await client.get(url, headers={'If-None-Match': '*'})).status_code == 304
+        assert (await client.get(dishes_url, headers={'Accept': 'application/x-ndjson',
+                                                      'If-None-Match': '*'})).status_code == 304
+        for url in ('/api/v1/menus/missing', f'{submenus_url}/missing', f'{dishes_url}/missing'):
+            assert (await client.get(url, headers={'If-None-Match': '*'})).status_code == 404
+        assert (await client.get(f'{submenus_url}/missing/dishes', headers={'Accept': 'application/x-ndjson',
+                                                                            'If-None-Match': '*'})).status_code == 404
+
+        await client.delete(f'/api/v1/menus/{menu_id}')
+        assert (await client.get(f'/api/v1/menus/{menu_id}', headers={'If-None-Match': '*'})).status_code == 404
+
+
+@pytest.mark.asyncio(loop_scope='module')
+async def test_versions_do_not_repeat_after_redis_loses_its_data() -> None:
+    connection = await cache_manager.get_redis_connection()
+    await cache_manager.invalidate_many(generations=[cache_keys.menus_generation()])
+    counter = await connection.get(cache_keys.menus_generation())
+    version = await cache_manager.get_version(cache_keys.menus_scope())
+
+    # Losing the data, limited to the keys this version is made of: the app's Redis
+    # database also holds the Celery results and the sync state
+    await connection.delete(cache_keys.epoch(), cache_keys.menus_generation())
+    # The counter happens to climb back to the same value
+    await connection.set(cache_keys.menus_generation(), counter)
+
+    assert await cache_manager.get_version(cache_keys.menus_scope()) != version
+
+
+@pytest.mark.asyncio(loop_scope='module')
+async def test_deleted_scopes_retire_their_counters() -> None:
+    connection = await cache_manager.get_redis_connection()
+    async with httpx.AsyncClient(app=app, base_url='http://localhost:8000') as client:
+        menu = {'title': 'Retired menu', 'description': 'Menu description'}
+        menu_id = (await client.post('/api/v1/menus', json=menu)).json()['id']
+        submenu_id = (await client.post(f'/api/v1/menus/{menu_id}/submenus', json=menu)).json()['id']
+        await client.get(f'/api/v1/menus/{menu_id}')
+        assert await connection.ttl(cache_keys.menus_generation()) == -1
+
+        assert (await client.delete(f'/api/v1/menus/{menu_id}')).status_code == 200
+        for generation in (cache_keys.menu_generation(menu_id), cache_keys.submenu_generation(menu_id, submenu_id)):
+            assert 0 < await connection.ttl(generation) <= CACHE_RETIRED_GENERATION_TTL
+        # Still bumped: what was cached before the delete stays out of reach
+        assert (await client.get(f'/api/v1/menus/{menu_id}')).status_code == 404
+        assert await connection.ttl(cache_keys.menus_generation()) == -1
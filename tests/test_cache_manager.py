@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import time
+
+import pytest
+from redis import asyncio as aioredis  # type: ignore[import]
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import cache_manager
+from app.cache_manager import LocalCache
+from config import CACHE_INVALIDATION_CHANNEL
+
+
+def test_local_cache_lru_eviction() -> None:
+    cache = LocalCache(max_entries=2, ttl=60)
+    cache.set('a', b'1')
+    cache.set('b', b'2')
+    assert cache.get('a') == b'1'  # 'a' becomes most recently used
+    cache.set('c', b'3')
+
+    assert cache.get('b') is None
+    assert cache.get('a') == b'1'
+    assert cache.get('c') == b'3'
+    assert cache.stats() == {'entries': 2, 'hits': 3, 'misses': 1, 'evictions': 1, 'invalidations': 0}
+
+
+def test_local_cache_ttl_and_invalidation() -> None:
+    cache = LocalCache(max_entries=10, ttl=60)
+    cache.set('short', b'1', ttl=0.01)
+    cache.set('long', b'2')
+    time.sleep(0.02)
+
+    assert cache.get('short') is None
+    cache.invalidate(['long', 'unknown'])
+    assert cache.get('long') is None
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['invalidations'] == 1
+
+
+@pytest.mark.asyncio
+async def test_invalidation_listener_survives_idle_periods(monkeypatch, caplog) -> None:
+    # A socket timeout far below the idle period: reads must not time out between messages
+    client = aioredis.Redis.from_url(cache_manager.REDIS_URL, socket_timeout=0.2)
+    monkeypatch.setattr(cache_manager, '_redis', client)
+    cache_manager.start_invalidation_listener()
+    try:
+        while not cache_manager._listener_connected:
+            await asyncio.sleep(0.01)
+        cache_manager.local_cache.set('probe', b'1')
+
+        await asyncio.sleep(1)
+
+        assert cache_manager._listener_connected
+        assert cache_manager.local_cache.get('probe') == b'1'
+        assert not [record for record in caplog.records if record.levelno >= logging.ERROR]
+
+        await client.publish(CACHE_INVALIDATION_CHANNEL, 'probe')
+        for _ in range(100):
+            if cache_manager.local_cache.get('probe') is None:
+                break
+            await asyncio.sleep(0.01)
+        assert cache_manager.local_cache.get('probe') is None
+    finally:
+        await cache_manager.stop_invalidation_listener()
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_soft_expired_entries_get_a_new_ttl_without_recomputing(monkeypatch) -> None:
+    client = aioredis.Redis.from_url(cache_manager.REDIS_URL)
+    monkeypatch.setattr(cache_manager, '_redis', client)
+    key = 'menuapp:test:soft'
+    computed = []
+
+    async def compute(db) -> bytes:
+        computed.append(db)
+        return b'value'
+
+    try:
+        assert await cache_manager.get_or_compute(key, compute, None) == b'value'
+        # Past its soft expiry, one second from the hard one
+        await client.set(key, cache_manager._pack(b'value', -1), ex=1)
+        cache_manager.local_cache.invalidate([key])
+
+        assert await cache_manager.get_or_compute(key, compute, None) == b'value'
+        await asyncio.gather(*cache_manager._refreshing.values())
+
+        assert len(computed) == 1
+        assert await client.ttl(key) > 1
+    finally:
+        await client.delete(key)
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_invalidated_pages_serve_their_previous_version_while_one_refresh_runs(monkeypatch) -> None:
+    client = aioredis.Redis.from_url(cache_manager.REDIS_URL)
+    monkeypatch.setattr(cache_manager, '_redis', client)
+    generation = 'menuapp:test:gen:swr'
+    slot = 'menuapp:test:swr:vlatest'
+    computed = []
+
+    async def compute(db) -> bytes:
+        computed.append(db)
+        await asyncio.sleep(0.05)
+        return b'value %d' % len(computed)
+
+    async def read(version: str) -> tuple[str, bytes]:
+        return await cache_manager.get_or_revalidate(f'menuapp:test:swr:v{version}', slot, [generation],
+                                                     compute, AsyncSession(), family='menus')
+
+    try:
+        assert await read('1') == ('menuapp:test:swr:v1', b'value 1')
+
+        # Invalidated: every reader gets version 1 right away, and it is computed again once
+        await client.incr(generation)
+        assert await asyncio.gather(*(read('2') for _ in range(5))) == [('menuapp:test:swr:v1', b'value 1')] * 5
+        await asyncio.gather(*cache_manager._refreshing.values())
+        assert len(computed) == 2
+        assert await read('2') == ('menuapp:test:swr:v2', b'value 2')
+        assert await client.get(slot) == b'menuapp:test:swr:v2'
+
+        # Retired (the menu or submenu was deleted): nothing stale to serve, the reader waits
+        await client.expire(generation, 60)
+        assert await read('3') == ('menuapp:test:swr:v3', b'value 3')
+    finally:
+        await client.delete(generation, slot, *[f'menuapp:test:swr:v{version}' for version in '123'])
+        await client.close()
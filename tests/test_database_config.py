@@ -0,0 +1,30 @@
+from db.config import DatabaseSettings
+
+
+def test_role_variables_override_shared_ones(monkeypatch) -> None:
+    monkeypatch.setenv('DATABASE_URL', 'postgresql+asyncpg://app@db/menu')
+    monkeypatch.setenv('WORKER_DATABASE_URL', 'postgresql+asyncpg://app@postgres/menu')
+    monkeypatch.setenv('DB_POOL_SIZE', '7')
+    monkeypatch.setenv('WORKER_DB_POOL_SIZE', '1')
+    monkeypatch.setenv('DB_POOL_PRE_PING', 'false')
+
+    api = DatabaseSettings.from_env('api')
+    worker = DatabaseSettings.from_env('worker')
+
+    assert (api.url, api.pool_size, api.max_overflow, api.pool_pre_ping) == ('postgresql+asyncpg://app@db/menu', 7, 20, False)
+    assert (worker.url, worker.pool_size, worker.max_overflow) == ('postgresql+asyncpg://app@postgres/menu', 1, 0)
+
+
+def test_engine_options() -> None:
+    options = DatabaseSettings(url=None, statement_timeout=5000, statement_cache_size=500).engine_options()
+
+    assert options['connect_args'] == {'prepared_statement_cache_size': 500,
+                                       'server_settings': {'statement_timeout': '5000'}}
+
+
+def test_pgbouncer_mode_disables_prepared_statement_caching() -> None:
+    connect_args = DatabaseSettings(url=None, statement_timeout=5000, pgbouncer=True).engine_options()['connect_args']
+    name_func = connect_args.pop('prepared_statement_name_func')
+
+    assert connect_args == {'prepared_statement_cache_size': 0, 'statement_cache_size': 0, 'command_timeout': 5.0}
+    assert name_func() != name_func()
@@ -0,0 +1,41 @@
+import csv
+import json
+
+from tools.parse_excel import iter_menus, iter_menus_from_rows
+
+ROWS = [
+    ('m1', 'Menu', 'Menu description'),
+    (None, 's1', 'Submenu', 'Submenu description'),
+    (None, None, 'd1', 'Dish', 'Dish description', 100, 0.1),
+    (None, None, 'd2', 'Dish 2', 'Dish description', 50.5, None),
+    ('m2', 'Empty menu', 'No submenus'),
+]
+
+MENUS = [
+    {'id': 'm1', 'title': 'Menu', 'description': 'Menu description', 'submenus': [
+        {'id': 's1', 'title': 'Submenu', 'description': 'Submenu description', 'dishes': [
+            {'id': 'd1', 'title': 'Dish', 'description': 'Dish description', 'price': '100.0', 'discount': 0.1},
+            {'id': 'd2', 'title': 'Dish 2', 'description': 'Dish description', 'price': '50.5', 'discount': None},
+        ]},
+    ]},
+    {'id': 'm2', 'title': 'Empty menu', 'description': 'No submenus', 'submenus': []},
+]
+
+
+def test_rows_yield_menus_one_at_a_time() -> None:
+    menus = iter_menus_from_rows([(None, 'orphan submenu'), *ROWS])
+
+    assert next(menus) == MENUS[0]
+    assert list(menus) == MENUS[1:]
+
+
+def test_csv_and_ndjson_match_the_spreadsheet_structure(tmp_path) -> None:
+    csv_path = tmp_path / 'menu.csv'
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows(ROWS)
+
+    ndjson_path = tmp_path / 'menu.ndjson'
+    ndjson_path.write_text(''.join(json.dumps(menu) + '\n' for menu in MENUS), encoding='utf-8')
+
+    assert list(iter_menus(str(csv_path))) == MENUS
+    assert list(iter_menus(str(ndjson_path))) == MENUS
@@ -0,0 +1,57 @@
+from collections import namedtuple
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.responses import ORJSONResponse
+from app.schema.schemas import Menu
+from app.serialization import (
+    complete_menu_dict,
+    dish_dict,
+    dumps,
+    loads,
+    menu_dict,
+    trusted,
+)
+
+MenuRow = namedtuple('MenuRow', 'id title description submenus_count dishes_count extra')
+
+
+def test_encoders_keep_only_the_response_fields() -> None:
+    row = MenuRow('m1', 'Menu', 'Menu description', 2, 5, 'not exposed')
+
+    assert menu_dict(row) == {'id': 'm1', 'title': 'Menu', 'description': 'Menu description',
+                              'submenus_count': 2, 'dishes_count': 5}
+
+
+def test_tree_rows_pass_the_nested_json_through() -> None:
+    TreeRow = namedtuple('TreeRow', 'title id description submenus')
+    submenus = [{'title': 'Submenu', 'description': '', 'dishes': [{'id': 'd1', 'title': 'Dish', 'description': '',
+                                                                    'price': '10.50'}]}]
+
+    encoded = complete_menu_dict(TreeRow('Menu', 'm1', '', submenus))
+
+    assert encoded['submenus'] is submenus
+    assert loads(dumps([encoded])) == [{'title': 'Menu', 'id': 'm1', 'description': '', 'submenus': submenus}]
+
+
+def test_response_bodies_use_the_cache_encoder() -> None:
+    DishRow = namedtuple('DishRow', 'id title description price')
+    dish = DishRow('d1', 'Dish', 'Dish description', '10.50')
+
+    assert ORJSONResponse(dish_dict(dish)).body == dumps(dish_dict(dish))
+
+
+def test_trusted_models_are_not_revalidated() -> None:
+    # A NULL description (menus loaded from a file may have one) would fail Menu validation
+    row = MenuRow('m1', 'Menu', None, 0, 0, 'not exposed')
+    app = FastAPI(default_response_class=ORJSONResponse)
+
+    @app.get('/menu', response_model=Menu)
+    async def read_menu() -> Menu:
+        return trusted(Menu, row)
+
+    response = TestClient(app).get('/menu')
+
+    assert response.status_code == 200
+    assert response.json() == {'title': 'Menu', 'description': None, 'id': 'm1', 'submenus_count': 0, 'dishes_count': 0}
@@ -0,0 +1,22 @@
+import time
+
+from app import cache_manager, celery_worker
+from app.worker_runtime import WorkerRuntime
+
+
+def test_worker_process_init_does_not_wait_for_dependencies(monkeypatch) -> None:
+    # Nothing listens there: the readiness probe keeps failing for WORKER_READY_TIMEOUT
+    monkeypatch.setenv('WORKER_DATABASE_URL', 'postgresql+asyncpg://menu@127.0.0.1:1/menu')
+    runtime = WorkerRuntime()
+    # The runtime opens (and closes) its own Redis client on its loop
+    monkeypatch.setattr(cache_manager, '_redis', None)
+    monkeypatch.setattr(celery_worker, 'runtime', runtime)
+
+    started = time.monotonic()
+    celery_worker.start_runtime()
+    try:
+        # Well within the prefork pool's worker_proc_alive_timeout (4s by default)
+        assert time.monotonic() - started < 1
+        assert not runtime.ready
+    finally:
+        runtime.stop()
@@ -1,11 +1,23 @@
 import hashlib
+import os
 
 
 def file_hash(filepath: str) -> str:
+    digest = hashlib.md5()
     with open(filepath, 'rb') as f:
-        return hashlib.md5(f.read()).hexdigest()
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
-def has_file_changed(filepath: str, previous_hash: str) -> tuple[bool, str]:
+def file_signature(filepath: str) -> str:
+    """
+    Cheap change pre-check: modification time and size, no content read.
+    """
+    stat = os.stat(filepath)
+    return f'{stat.st_mtime_ns}:{stat.st_size}'
+
+
+def has_file_changed(filepath: str, previous_hash: str | None) -> tuple[bool, str]:
     current_hash = file_hash(filepath)
     return current_hash != previous_hash, current_hash
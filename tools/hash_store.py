@@ -1,11 +1,25 @@
-def save_hash(hash_value, filepath='last_hash.txt') -> None:
-    with open(filepath, 'w') as file:
-        file.write(hash_value)
+from app.cache_keys import NAMESPACE
+from app.cache_manager import get_redis_connection
 
 
-def load_hash(filepath='last_hash.txt') -> str | None:
-    try:
-        with open(filepath) as file:
-            return file.readline().strip()
-    except FileNotFoundError:
-        return None
+def _state_key(filepath: str) -> str:
+    return f'{NAMESPACE}:sync:file:{filepath}'
+
+
+async def save_hash(hash_value: str, signature: str, filepath: str) -> None:
+    """
+    Remember the content hash and the mtime/size signature of the last synchronized
+    file in Redis, so that every worker agrees on it.
+    """
+    connection = await get_redis_connection()
+    await connection.hset(_state_key(filepath), mapping={'hash': hash_value, 'signature': signature})
+
+
+async def load_hash(filepath: str) -> tuple[str | None, str | None]:
+    """
+    Returns (hash, signature) of the last synchronized version of filepath.
+    """
+    connection = await get_redis_connection()
+    hash_value, signature = await connection.hmget(_state_key(filepath), ['hash', 'signature'])
+    return (hash_value.decode('utf-8') if hash_value else None,
+            signature.decode('utf-8') if signature else None)
@@ -0,0 +1,30 @@
+"""
+File-system notification trigger for the menu sync, an alternative to polling.
+
+Watches the directory of app.celery_worker.MENU_FILE_PATH (inotify on Linux, through
+watchfiles) and queues add_menu with triggered=True whenever the file is written,
+so changes are picked up at once even while the adaptive interval has backed off.
+
+    python -m tools.menu_watcher
+"""
+import logging
+import os
+
+from watchfiles import watch
+
+from app.celery_worker import MENU_FILE_PATH, add_menu
+
+logging.basicConfig(level=logging.INFO)
+
+
+def watch_menu_file(file_path: str = MENU_FILE_PATH) -> None:
+    target = os.path.abspath(file_path)
+    # Editors save through temporary files and renames, so watch the directory and filter
+    for changes in watch(os.path.dirname(target), debounce=1000):
+        if any(os.path.abspath(path) == target for _, path in changes):
+            logging.info(f'{file_path} changed, queueing add_menu')
+            add_menu.apply_async(kwargs={'triggered': True})
+
+
+if __name__ == '__main__':
+    watch_menu_file()
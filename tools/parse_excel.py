@@ -1,52 +1,116 @@
+import csv
 import json
+from collections.abc import Iterable, Iterator, Sequence
+from pathlib import Path
 from typing import Any
 
 from openpyxl import load_workbook
 
+ROW_WIDTH = 7  # menu id | submenu id | dish id | title | description | price | discount, shifted per level
+
 
 def write_to_json_file(data: Any, file_path: str) -> None:
     with open(file_path, 'w', encoding='utf-8') as f:
         json.dump(data, f, ensure_ascii=False, indent=4)
 
 
-def parse_menu_excel(file_path: str) -> list[dict]:
-    workbook = load_workbook(filename=file_path)
-    sheet = workbook.active
+def _dish(dish_id: str, title: Any, description: Any, price: Any, discount: Any) -> dict:
+    dish_price = float(price) if price else None
+    dish_discount = float(discount) if discount else None
+    return {'id': dish_id, 'title': title, 'description': description,
+            'price': str(dish_price), 'discount': dish_discount}
+
 
-    menus = []
+def iter_menus_from_rows(rows: Iterable[Sequence]) -> Iterator[dict]:
+    """
+    Build menus from spreadsheet-shaped rows, yielding each menu once the next one starts.
+
+    A value in the first column starts a menu, in the second a submenu of the current
+    menu, in the third a dish of the current submenu; rows before the first menu and
+    dishes outside a submenu are skipped. Empty cells may be None or ''.
+    """
     current_menu = None
     current_submenu = None
 
-    for row in sheet.iter_rows():
-        menu_id = row[0].value if row[0].value else None
-        if menu_id:
-            menu_title = row[1].value
-            menu_description = row[2].value
-            current_menu = {'id': menu_id, 'title': menu_title, 'description': menu_description, 'submenus': []}
-            menus.append(current_menu)
+    for row in rows:
+        row = (*row, *(None,) * (ROW_WIDTH - len(row)))
+        if row[0]:
+            if current_menu is not None:
+                yield current_menu
+            current_menu = {'id': row[0], 'title': row[1], 'description': row[2], 'submenus': []}
             current_submenu = None
             continue
 
         if current_menu is None:  # Skip rows until a menu is defined
             continue
 
-        submenu_id = row[1].value if row[1].value else None
-        if submenu_id:
-            submenu_title = row[2].value
-            submenu_description = row[3].value
-            current_submenu = {'id': submenu_id, 'title': submenu_title,
-                               'description': submenu_description, 'dishes': []}
+        if row[1]:
+            current_submenu = {'id': row[1], 'title': row[2], 'description': row[3], 'dishes': []}
             current_menu['submenus'].append(current_submenu)
             continue
 
-        dish_id = row[2].value if row[2].value else None
-        if dish_id and current_submenu:
-            dish_title = row[3].value
-            dish_description = row[4].value
-            dish_price = float(row[5].value) if len(row) > 5 and row[5].value else None
-            dish_discount = float(row[6].value) if len(row) > 6 and row[6].value else None
-            dish = {'id': dish_id, 'title': dish_title, 'description': dish_description,
-                    'price': str(dish_price), 'discount': dish_discount}
-            current_submenu['dishes'].append(dish)
-
-    return menus
+        if row[2] and current_submenu:
+            current_submenu['dishes'].append(_dish(row[2], row[3], row[4], row[5], row[6]))
+
+    if current_menu is not None:
+        yield current_menu
+
+
+def iter_menu_excel(file_path: str) -> Iterator[dict]:
+    """Stream menus from the active sheet of a workbook without loading it into memory."""
+    workbook = load_workbook(filename=file_path, read_only=True, data_only=True)
+    try:
+        yield from iter_menus_from_rows(workbook.active.iter_rows(values_only=True))
+    finally:
+        workbook.close()
+
+
+def iter_menu_csv(file_path: str) -> Iterator[dict]:
+    """Stream menus from a CSV file laid out like the spreadsheet."""
+    with open(file_path, newline='', encoding='utf-8') as f:
+        rows = ([value or None for value in row] for row in csv.reader(f))
+        yield from iter_menus_from_rows(rows)
+
+
+def iter_menu_json(file_path: str) -> Iterator[dict]:
+    """
+    Stream menus from NDJSON (.ndjson/.jsonl, one menu per line) or a JSON array (.json),
+    each menu shaped like the parser output.
+    """
+    with open(file_path, encoding='utf-8') as f:
+        if Path(file_path).suffix.lower() == '.json':
+            menus: Iterable[dict] = json.load(f)
+        else:
+            menus = (json.loads(line) for line in f if line.strip())
+
+        for menu in menus:
+            yield {
+                'id': menu['id'], 'title': menu.get('title'), 'description': menu.get('description'),
+                'submenus': [{
+                    'id': submenu['id'], 'title': submenu.get('title'), 'description': submenu.get('description'),
+                    'dishes': [_dish(dish['id'], dish.get('title'), dish.get('description'),
+                                     dish.get('price'), dish.get('discount')) for dish in submenu.get('dishes', [])],
+                } for submenu in menu.get('submenus', [])],
+            }
+
+
+PARSERS = {
+    '.xlsx': iter_menu_excel,
+    '.xlsm': iter_menu_excel,
+    '.csv': iter_menu_csv,
+    '.json': iter_menu_json,
+    '.ndjson': iter_menu_json,
+    '.jsonl': iter_menu_json,
+}
+
+
+def iter_menus(file_path: str) -> Iterator[dict]:
+    """Stream menus from any supported file, picking the parser by extension."""
+    suffix = Path(file_path).suffix.lower()
+    if suffix not in PARSERS:
+        raise ValueError(f'Unsupported menu file format: {suffix or file_path}')
+    return PARSERS[suffix](file_path)
+
+
+def parse_menu_excel(file_path: str) -> list[dict]:
+    return list(iter_menu_excel(file_path))
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager, suppress
+
+from redis.exceptions import LockError  # type: ignore[import]
+
+from app.cache_keys import NAMESPACE
+from app.cache_manager import get_redis_connection
+from config import (
+    SYNC_BACKOFF_FACTOR,
+    SYNC_LOCK_LEASE,
+    SYNC_MAX_INTERVAL,
+    SYNC_MIN_INTERVAL,
+)
+
+
+def _key(name: str, part: str) -> str:
+    return f'{NAMESPACE}:sync:{part}:{name}'
+
+
+async def _heartbeat(lock, lease: float) -> None:
+    while True:
+        await asyncio.sleep(lease / 3)
+        try:
+            await lock.reacquire()
+        except LockError:
+            logging.error(f'Lost the sync lock {lock.name!r}, another worker may start a concurrent sync')
+            return
+
+
+@asynccontextmanager
+async def sync_lock(name: str, lease: float = SYNC_LOCK_LEASE) -> AsyncIterator[bool]:
+    """
+    Redis lock held by at most one worker across the cluster; yields whether it was acquired.
+
+    The lease only bounds how long a crashed holder blocks the others: while the
+    holder is alive a heartbeat renews it every third of the lease.
+    """
+    connection = await get_redis_connection()
+    lock = connection.lock(_key(name, 'lock'), timeout=lease, blocking=False, thread_local=False)
+    if not await lock.acquire():
+        yield False
+        return
+
+    heartbeat = asyncio.create_task(_heartbeat(lock, lease))
+    try:
+        yield True
+    finally:
+        heartbeat.cancel()
+        with suppress(asyncio.CancelledError):
+            await heartbeat
+        try:
+            await lock.release()
+        except LockError:
+            logging.warning(f'Sync lock {lock.name!r} expired before it was released')
+
+
+async def _is_due(connection, name: str) -> bool:
+    next_run = await connection.hget(_key(name, 'schedule'), 'next_run')
+    return next_run is None or float(next_run) <= time.time()
+
+
+async def _reschedule(connection, name: str, changed: bool) -> float:
+    """Check again soon after a change; back off exponentially while nothing changes."""
+    interval = await connection.hget(_key(name, 'schedule'), 'interval')
+    if changed or interval is None:
+        interval = SYNC_MIN_INTERVAL
+    else:
+        interval = min(float(interval) * SYNC_BACKOFF_FACTOR, SYNC_MAX_INTERVAL)
+    await connection.hset(_key(name, 'schedule'), mapping={'interval': interval, 'next_run': time.time() + interval})
+    return interval
+
+
+async def run_coalesced(name: str, sync: Callable[[], Awaitable[bool]], triggered: bool = False) -> bool:
+    """
+    Run sync (which returns whether anything changed) under the cluster-wide lock.
+
+    Scheduled ticks that are not due yet under the adaptive interval return at once;
+    triggered runs (a file-system notification) skip that check. A tick that finds
+    a sync in progress only leaves a pending mark, and the running sync repeats
+    once for all the marks left while it ran. Returns whether sync ran.
+    """
+    connection = await get_redis_connection()
+    if not triggered and not await _is_due(connection, name):
+        return False
+
+    async with sync_lock(name) as acquired:
+        if not acquired:
+            await connection.set(_key(name, 'pending'), 1, ex=int(SYNC_MAX_INTERVAL))
+            logging.info(f'Sync {name!r} already running, tick coalesced into it')
+            return False
+
+        pending = True
+        while pending:
+            await connection.delete(_key(name, 'pending'))
+            changed = await sync()
+            interval = await _reschedule(connection, name, changed)
+            logging.info(f'Sync {name!r} done, next check in {interval:g}s')
+            pending = bool(await connection.exists(_key(name, 'pending')))
+        return True
@@ -1,166 +1,212 @@
+import hashlib
 import logging
+from collections.abc import Iterable
+from dataclasses import dataclass, field
 
-from sqlalchemy import select
+from sqlalchemy import String, any_, bindparam, delete, func, select
+from sqlalchemy.dialects.postgresql import ARRAY, insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.cache_manager import invalidate_cache
+from app import cache_keys
 from app.model.models import Dish, Menu, SubMenu
 
 logging.basicConfig(level=logging.DEBUG)
 
 
-async def synchronize_menus(session: AsyncSession, menus: list[dict]) -> list[str]:
+def dish_price(dish: dict) -> str:
+    if dish['discount'] is not None:
+        return str(round(float(dish['price']) * (1 - float(dish['discount'])), 2))
+    return dish['price']
 
-    invalidated_keys = []
 
-    existing_menus_query = await session.execute(select(Menu))
+def flatten_menus(menus: Iterable[dict]) -> tuple[dict[str, dict], dict[str, dict], dict[str, dict]]:
+    """
+    Turn the parsed spreadsheet tree into menu, submenu and dish rows keyed by id
+    (a repeated id keeps its last occurrence, as it would after sequential updates).
+    """
+    menu_rows: dict[str, dict] = {}
+    submenu_rows: dict[str, dict] = {}
+    dish_rows: dict[str, dict] = {}
 
-    existing_menus = {menu.id: menu for menu in existing_menus_query.scalars().all()}
-
-    remaining_submenus_to_delete: list[SubMenu] = []
-    remaining_dishes_to_delete: list[Dish] = []
     for menu in menus:
-        current_id = menu['id']
-        existing_menu = existing_menus.get(current_id)
-
-        if existing_menu:
-
-            existing_menu.title = menu['title']
-            existing_menu.description = menu['description']
-            invalidated_keys.append(f'menus-{existing_menu.id}')
-
-            submenus = menu['submenus']
-
-            result_submenus = await session.execute(select(SubMenu).filter(SubMenu.menu_id == current_id))
-            existing_submenus = {submenu.id: submenu for submenu in result_submenus.scalars().all()}
-
-            for submenu in submenus:
-                logging.info(f'We are running now submenus {submenu}')
-                current_id_submenu = submenu['id']
-                existing_submenu = existing_submenus.get(current_id_submenu)
-
-                if existing_submenu:
-
-                    existing_submenu.title = submenu['title']
-                    existing_submenu.description = submenu['description']
-
-#                   dish logic....
-                    dishes = submenu['dishes']
-                    result_dishes = await session.execute(select(Dish).filter(Dish.submenu_id == current_id_submenu))
-                    existing_dishes = {dish.id: dish for dish in result_dishes.scalars().all()}
-
-                    for dish in dishes:
-                        current_dish_id = dish['id']
-                        existing_dish = existing_dishes.get(current_dish_id)
-
-                        if existing_dish:
-                            existing_dish.title = dish['title']
-                            existing_dish.description = dish['description']
-                            if dish['discount'] is not None:
-                                existing_dish.price = str(
-                                    round(float(dish['price']) * (1 - float(dish['discount'])), 2))
-                            else:
-                                existing_dish.price = dish['price']
-                            await invalidate_cache(f'dishes-{current_id}-{current_id_submenu}-{current_dish_id}')
-                            del existing_dishes[dish['id']]
-                        else:
-                            if dish['discount'] is not None:
-                                new_price = str(round(float(dish['price']) * (1 - float(dish['discount'])), 2))
-                            else:
-                                new_price = dish['price']
-                            new_dish = Dish(id=dish['id'], title=dish['title'], submenu_id=current_id_submenu,
-                                            price=new_price, description=dish['description'])
-                            session.add(new_dish)
-                            # Invalidate cache if needed
-                            await invalidate_cache(f'dishes-{current_id}-{current_id_submenu}-{current_dish_id}')
-                            await invalidate_cache(f'dishes-{current_id}-{current_id_submenu}-0-100')
-                            await invalidate_cache(f'submenu-{current_id}-{current_id_submenu}')
-                            await invalidate_cache(f'submenus-{current_id}-0-100')
-                            await invalidate_cache(f'menus-{current_id}')
-                            await invalidate_cache('menus-0-100')
-
-                    remaining_dishes_to_delete.extend(existing_dishes.values())
-#                   dish logic....
-                    await invalidate_cache(f'submenu-{current_id}-{current_id_submenu}')
-                    del existing_submenus[submenu['id']]
-
-                else:
-
-                    new_submenu = SubMenu(id=current_id_submenu,
-                                          title=submenu['title'], menu_id=current_id, description=submenu['description'])
-                    session.add(new_submenu)
-                    await invalidate_cache(f'submenu-{current_id}-{current_id_submenu}')
-                    await invalidate_cache(f'submenus-{current_id}-0-100')
-                    await invalidate_cache(f'menus-{current_id}')
-                    await invalidate_cache('menus-0-100')
-
-            remaining_submenus_to_delete.extend(existing_submenus.values())
-
-            del existing_menus[menu['id']]
-
-        else:
-
-            new_menu = Menu(id=menu['id'], title=menu['title'], description=menu['description'])
-            session.add(new_menu)
-
-    for remaining_menu_id in existing_menus.keys():
-        result = await session.execute(select(Menu).filter(Menu.id == remaining_menu_id))
-
-        db_menu = result.scalars().first()
-        if db_menu:
-
-            await session.delete(db_menu)
-            invalidated_keys.append(f'menus-{remaining_menu_id}')
-
-    for remaining_submenu in remaining_submenus_to_delete:
-        menu_id = remaining_submenu.menu_id
-        submenu_id = remaining_submenu.id
-
-        result = await session.execute(select(SubMenu).filter(SubMenu.id == submenu_id))
-        db_submenu = result.scalars().first()
-
-        if db_submenu:
-            await session.delete(db_submenu)
-
-            cache_key_single = f'submenu-{menu_id}-{submenu_id}'
-            await invalidate_cache(cache_key_single)
-
-            cache_key_list = f'submenus-{menu_id}-0-100'
-            await invalidate_cache(cache_key_list)
-
-    for remaining_dish in remaining_dishes_to_delete:
-
-        dish_id = remaining_dish.id
-        submenu_id = remaining_dish.submenu_id
-
-        result_submenu = await session.execute(select(SubMenu).filter(SubMenu.id == submenu_id))
-        db_submenu = result_submenu.scalars().first()
-        menu_id = db_submenu.menu_id if db_submenu else None
-
-        result_dish = await session.execute(select(Dish).filter(Dish.id == dish_id))
-        db_dish = result_dish.scalars().first()
-
-        if db_dish:
-            await session.delete(db_dish)
-
-            cache_key_dish = f'dish-{menu_id}-{submenu_id}-{dish_id}'
-            await invalidate_cache(cache_key_dish)
-
-            cache_key_dishes = f'dishes-{menu_id}-{submenu_id}-0-100'
-            await invalidate_cache(cache_key_dishes)
-
-            cache_key_submenu = f'submenu-{menu_id}-{submenu_id}'
-            await invalidate_cache(cache_key_submenu)
-
-            cache_key_submenus = f'submenus-{menu_id}-0-100'
-            await invalidate_cache(cache_key_submenus)
-
-            cache_key_menu = f'menus-{menu_id}'
-            await invalidate_cache(cache_key_menu)
-
-            cache_key_menu_all = 'menus-0-100'
-            await invalidate_cache(cache_key_menu_all)
+        menu_rows[menu['id']] = {'id': menu['id'], 'title': menu['title'], 'description': menu['description']}
+        for submenu in menu['submenus']:
+            submenu_rows[submenu['id']] = {'id': submenu['id'], 'title': submenu['title'],
+                                           'description': submenu['description'], 'menu_id': menu['id']}
+            for dish in submenu['dishes']:
+                dish_rows[dish['id']] = {'id': dish['id'], 'title': dish['title'], 'description': dish['description'],
+                                         'price': dish_price(dish), 'submenu_id': submenu['id']}
+
+    return menu_rows, submenu_rows, dish_rows
+
+
+def fingerprint(row: dict) -> str:
+    """Content fingerprint of a row: changes whenever any of its columns does."""
+    content = '\x1f'.join(f'{column}={row[column]}' for column in sorted(row))
+    return hashlib.md5(content.encode('utf-8')).hexdigest()
+
+
+@dataclass
+class EntityChanges:
+    inserted: list[str] = field(default_factory=list)
+    updated: list[str] = field(default_factory=list)
+    deleted: list[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.inserted or self.updated or self.deleted)
+
+
+@dataclass
+class Changeset:
+    """Ids inserted, updated and deleted by synchronize_menus, per table."""
+    menus: EntityChanges = field(default_factory=EntityChanges)
+    submenus: EntityChanges = field(default_factory=EntityChanges)
+    dishes: EntityChanges = field(default_factory=EntityChanges)
+    generations: list[str] = field(default_factory=list)
+    retired: list[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.menus or self.submenus or self.dishes)
+
+    def counts(self) -> dict[str, dict[str, int]]:
+        return {name: {kind: len(getattr(changes, kind)) for kind in ('inserted', 'updated', 'deleted')}
+                for name, changes in (('menus', self.menus), ('submenus', self.submenus), ('dishes', self.dishes))}
+
+
+def diff_rows(existing: dict[str, dict], incoming: dict[str, dict]) -> EntityChanges:
+    """Compare the stored rows with the spreadsheet rows by fingerprint."""
+    changes = EntityChanges()
+    for row_id, row in incoming.items():
+        if row_id not in existing:
+            changes.inserted.append(row_id)
+        elif fingerprint(existing[row_id]) != fingerprint(row):
+            changes.updated.append(row_id)
+    changes.deleted = [row_id for row_id in existing if row_id not in incoming]
+    return changes
+
+
+async def _read_rows(session: AsyncSession, model, columns: list[str]) -> dict[str, dict]:
+    result = await session.execute(select(*(getattr(model, column) for column in columns)))
+    return {row.id: dict(row._mapping) for row in result}
+
+
+async def _upsert(session: AsyncSession, model, rows: list[dict]) -> None:
+    """
+    INSERT ... SELECT unnest(...) ON CONFLICT DO UPDATE: one statement whatever the row count,
+    with one array parameter per column, so the count triggers (migration 0003) fire once.
+    """
+    if not rows:
+        return
+    columns = list(rows[0])
+    source = select(*(func.unnest(bindparam(column, [row[column] for row in rows], type_=ARRAY(String))).label(column)
+                      for column in columns))
+    stmt = insert(model).from_select(columns, source)
+    stmt = stmt.on_conflict_do_update(index_elements=[model.id],
+                                      set_={column: stmt.excluded[column] for column in columns if column != 'id'})
+    await session.execute(stmt)
+
+
+async def _delete(session: AsyncSession, model, ids: list[str]) -> None:
+    if not ids:
+        return
+    stmt = delete(model).where(model.id == any_(bindparam('ids', type_=ARRAY(String))))
+    await session.execute(stmt.execution_options(synchronize_session=False), {'ids': ids})
+
+
+def _changed_generations(changeset: Changeset,
+                         menus: tuple[dict[str, dict], dict[str, dict]],
+                         submenus: tuple[dict[str, dict], dict[str, dict]],
+                         dishes: tuple[dict[str, dict], dict[str, dict]]) -> list[str]:
+    """
+    Cache generation counters (see app.cache_keys) covering the changed rows.
+
+    Each argument pairs the stored rows with the spreadsheet rows, so a row that moved
+    to another parent invalidates both. A row appearing in or leaving a parent also
+    bumps the menus list and the parent menu, which expose submenu and dish counts.
+    """
+    generations: set[str] = set()
+
+    def parents(rows: tuple[dict[str, dict], dict[str, dict]], row_id: str, column: str) -> set[str]:
+        return {side[row_id][column] for side in rows if row_id in side}
+
+    def recounted(changes: EntityChanges, rows: tuple[dict[str, dict], dict[str, dict]], column: str) -> list[str]:
+        moved = [row_id for row_id in changes.updated if len(parents(rows, row_id, column)) > 1]
+        return changes.inserted + changes.deleted + moved
+
+    if changeset.menus:
+        generations.add(cache_keys.menus_generation())
+    for menu_id in changeset.menus.updated + changeset.menus.deleted:
+        generations.add(cache_keys.menu_generation(menu_id))
+
+    for submenu_id in changeset.submenus.inserted + changeset.submenus.updated + changeset.submenus.deleted:
+        generations.update(cache_keys.menu_generation(menu_id) for menu_id in parents(submenus, submenu_id, 'menu_id'))
+    if recounted(changeset.submenus, submenus, 'menu_id'):
+        generations.add(cache_keys.menus_generation())
+
+    for dish_id in changeset.dishes.inserted + changeset.dishes.updated + changeset.dishes.deleted:
+        for submenu_id in parents(dishes, dish_id, 'submenu_id'):
+            for menu_id in parents(submenus, submenu_id, 'menu_id'):
+                generations.add(cache_keys.submenu_generation(menu_id, submenu_id))
+    for dish_id in recounted(changeset.dishes, dishes, 'submenu_id'):
+        generations.add(cache_keys.menus_generation())
+        for submenu_id in parents(dishes, dish_id, 'submenu_id'):
+            generations.update(cache_keys.menu_generation(menu_id) for menu_id in parents(submenus, submenu_id, 'menu_id'))
+
+    return sorted(generations)
+
+
+def _retired_generations(changeset: Changeset, submenus: tuple[dict[str, dict], dict[str, dict]]) -> list[str]:
+    """
+    Counters of the menus and submenus the sync deleted, to be retired (see
+    cache_manager.invalidate_many), including those of submenus moved to another menu.
+    """
+    existing, incoming = submenus
+    retired = {cache_keys.menu_generation(menu_id) for menu_id in changeset.menus.deleted}
+    for submenu_id in changeset.submenus.deleted + changeset.submenus.updated:
+        menu_id = existing[submenu_id]['menu_id']
+        if submenu_id not in incoming or incoming[submenu_id]['menu_id'] != menu_id:
+            retired.add(cache_keys.submenu_generation(menu_id, submenu_id))
+    return sorted(retired)
+
+
+async def synchronize_menus(session: AsyncSession, menus: Iterable[dict]) -> Changeset:
+    """
+    Make the menus, submenus and dishes tables match the parsed spreadsheet.
+
+    The current rows are read with one query per table and compared with the
+    spreadsheet by content fingerprint; only inserted and changed rows are
+    upserted (one INSERT ... ON CONFLICT DO UPDATE per table) and missing ones
+    deleted (one DELETE ... WHERE id = ANY(...) per table), in a single transaction.
+
+    Returns the changeset, including the cache generation counters to bump and to
+    retire; the caller flushes them in one round trip.
+    """
+    menu_rows, submenu_rows, dish_rows = flatten_menus(menus)
+
+    existing_menus = await _read_rows(session, Menu, ['id', 'title', 'description'])
+    existing_submenus = await _read_rows(session, SubMenu, ['id', 'title', 'description', 'menu_id'])
+    existing_dishes = await _read_rows(session, Dish, ['id', 'title', 'description', 'price', 'submenu_id'])
+
+    changeset = Changeset(menus=diff_rows(existing_menus, menu_rows),
+                          submenus=diff_rows(existing_submenus, submenu_rows),
+                          dishes=diff_rows(existing_dishes, dish_rows))
+    if not changeset:
+        logging.info('Spreadsheet matches the database, nothing to synchronize')
+        return changeset
+
+    # Parents first so foreign keys hold, deletes last so rows moved to another parent survive the cascade
+    for model, changes, rows in ((Menu, changeset.menus, menu_rows),
+                                 (SubMenu, changeset.submenus, submenu_rows),
+                                 (Dish, changeset.dishes, dish_rows)):
+        await _upsert(session, model, [rows[row_id] for row_id in changes.inserted + changes.updated])
+    await _delete(session, Dish, changeset.dishes.deleted)
+    await _delete(session, SubMenu, changeset.submenus.deleted)
+    await _delete(session, Menu, changeset.menus.deleted)
 
     await session.commit()
 
-    return invalidated_keys
+    changeset.generations = _changed_generations(changeset, (existing_menus, menu_rows),
+                                                 (existing_submenus, submenu_rows), (existing_dishes, dish_rows))
+    changeset.retired = _retired_generations(changeset, (existing_submenus, submenu_rows))
+    logging.info(f'Synchronized menus: {changeset.counts()}')
+    return changeset